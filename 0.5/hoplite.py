@@ -17,6 +17,7 @@ import copy
 import time
 import uuid
 import shutil
+import logging
 import argparse
 import hoplite_utils
 
@@ -34,12 +35,16 @@ from partitioners import partitioner_ordered
 from partitioners import partitioner_hierfm
 
 from searches import search_max_minus_one
+from searches import wlv_cache
 
 # -----------------------------------------------------------------
 # Check if current version of interpreter is new enough.
 #
 hoplite_utils.check_version()
 
+# Progress of the framework libraries is reported through logging.
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+
 # -----------------------------------------------------------------
 # Parse arguments from input and configure help info.
 #
@@ -170,7 +175,22 @@ elif model == 'montecarlo':
 else: # Default case: No valid signal/noise model.
   exit("Signal/noise model " + model + "not recognized.")
 
-search_object = search_max_minus_one.search_max_minus_one(source_config, model_object)
+# Noise queries of the model are memoized for all the searches. Evicted
+#  entries can be spilled to disk, to be reused when restarting with -k.
+#  The spill file is named after everything the model depends on, so
+#  a different source or configuration never reads stale entries.
+cache_spill = None
+if config.get('wlv_cache_spill', False):
+  cache_key = wlv_cache.fingerprint(model, partition_tool, config, source_config, system_graph)
+  cache_spill = os.path.join(output, 'wlv_cache_' + cache_key)
+cache_object = wlv_cache.wlv_cache(model_object, size=config.get('wlv_cache_size', 4096), spill=cache_spill)
+
+search_object = search_max_minus_one.search_max_minus_one(source_config, cache_object,
+                                                          workers=config.get('search_workers', None),
+                                                          pool=config.get('search_pool', 'thread'),
+                                                          min_wl=config.get('search_min_wl', 1),
+                                                          max_wl=config.get('search_max_wl', 32),
+                                                          check_monotonicity=config.get('search_check_monotonicity', False))
 
 start_time = time.time()
 
@@ -182,9 +202,11 @@ print("Modelling: %s seconds" % exeution_time)
 start_time = time.time()
 
 search_object.run()
+cache_object.close()
 
 exeution_time = time.time() - start_time
 print("Search: %s seconds" % exeution_time)
+print("WLV cache: %d hits, %d misses" % (cache_object.hits, cache_object.misses))
 
 # Busqueda.
 
@@ -10,8 +10,11 @@ import os
 import sys
 import time
 import sympy
+import numpy
+import logging
 import argparse
 import subprocess
+import collections
 
 from models.lib import c_matrix
 
@@ -27,7 +30,9 @@ def check_version():
 # get_execution_order(source)
 #
 # Generate a list of the order of execution of the nodes inside
-#  the system graph.
+#  the system graph. Nodes are released as soon as all their
+#  predecessors have been executed (Kahn's algorithm), so every
+#  node and edge is visited only once.
 #
 # Beware: This function works only for linear graphs (no loops) 
 #
@@ -35,28 +40,84 @@ def get_execution_order(source):
   execution_order = []
 
   dependencies = {x: len(source[x]['preds']) for x in source}
-  dependent   = [x for x in dependencies if dependencies[x] >  0]
-  independent = [x for x in dependencies if dependencies[x] == 0]
+  independent  = collections.deque(sorted(x for x in dependencies if dependencies[x] == 0))
 
-  while dependent:
-    for node in independent:
-      execution_order.append(node)
-      for succ in source[node]['succs']:
+  while independent:
+    node = independent.popleft()
+    execution_order.append(node)
+    for succ in source[node]['succs']:
+      if succ in dependencies:
         dependencies[succ] = dependencies[succ] - 1
-      del dependencies[node]
-    dependent   = [x for x in dependencies if dependencies[x] >  0]
-    independent = [x for x in dependencies if dependencies[x] == 0]
-  else:
-    for node in independent:
-      execution_order.append(node)
+        if dependencies[succ] == 0:
+          independent.append(succ)
 
   return execution_order
 
-# generateCmatrix(n_vars, order)
+# Operation codes used in the execution plans.
+OP_NONE   = -1
+OP_INPUT  = 0
+OP_CONST  = 1
+OP_OUTPUT = 2
+OP_ADD    = 3
+OP_SUB    = 4
+OP_MUL    = 5
+OP_NOISE  = 6
+OP_DIV    = 7
+
+OPCODES = {'input': OP_INPUT, 'const': OP_CONST, 'output': OP_OUTPUT, 'add': OP_ADD,
+           'sub': OP_SUB, 'mul': OP_MUL, 'noise': OP_NOISE, 'div': OP_DIV}
+
+# compile_execution_plan(source)
+#
+# Compiles the system graph into a flat execution plan that can be
+#  replayed as many times as needed with different input values:
+#  the nodes in execution order, their operation codes and the ids of
+#  their (up to two) operands, -1 when missing. Nodes with operations
+#  that are not propagated (br, cmp, ...) get OP_NONE.
+#
+def compile_execution_plan(source):
+  order = get_execution_order(source)
+
+  ops      = numpy.array([OPCODES.get(source[x]['op'], OP_NONE) for x in order], dtype=numpy.int8)
+  operands = numpy.empty((len(order), 2), dtype=numpy.int32)
+  operands.fill(-1)
+  for n in range(len(order)):
+    if ops[n] != OP_NONE:
+      preds = source[order[n]]['preds'][:2]
+      operands[n, :len(preds)] = preds
+
+  return {'order':    order,
+          'ops':      ops,
+          'operands': operands,
+          'size':     max(source.keys()) + 1}
+
+# add_execution_plan(graph)
+#
+# Compiles the execution plan of the nodes of the graph and stores it
+#  in graph['plan'], which is where the models take it from when the
+#  graph is propagated. It has to be called again if the nodes of the
+#  graph change. Returns the graph.
+#
+def add_execution_plan(graph):
+  graph['plan'] = compile_execution_plan(graph['nodes'])
+  return graph
+
+# add_execution_plans(path)
+#
+# Adds the execution plans of the graph of an execution path and of its
+#  cmp trees (see add_execution_plan()).
+#
+def add_execution_plans(path):
+  add_execution_plan(path['path'])
+  for tree in path['cmp_trees'].values():
+    add_execution_plan(tree)
+  return path
+
+# generateCmatrix(n_vars, order, workers=None)
 #
 # Generates a C matrix of the given dimensions and stores it
-#  in the preloads directory.
-def generateCmatrix(n_vars, order):
+#  in the preloads directory, using a pool of 'workers' processes.
+def generateCmatrix(n_vars, order, workers=None):
   vars = [sympy.Symbol('v'+str(i)) for i in range(n_vars)]
   print '========== HOPLITE utils =========='
   print 'Generating C matrix:'
@@ -64,7 +125,7 @@ def generateCmatrix(n_vars, order):
   print ' - Order:', order
   
   start_time = time.time()
-  c = c_matrix.c_matrix(vars,order)
+  c = c_matrix.c_matrix(vars,order,workers)
   exeution_time = time.time() - start_time
   print ('C matrix successfully generated (%s seconds).' % exeution_time)
   print '===================================' 
@@ -117,10 +178,13 @@ def informationCmatrix(n_vars, order):
 # The hoplite_utils file can be executed as a standalone script too, in order to
 #  run some independent utilities that also belong to the hoplite framework.
 if __name__ == "__main__":
+  logging.basicConfig(level=logging.INFO, format='%(message)s')
 
   parser = argparse.ArgumentParser()
   parser.add_argument('--genC', type=int, nargs=2, metavar=('n_vars', 'order'),
                       help='Generates a C matrix of the given dimensions and stores is in the preloads directory.')
+  parser.add_argument('-w', '--workers', type=int, default=None,
+                      help='Number of processes used to generate the C matrix with --genC.')
   parser.add_argument('--infoC', type=int, nargs=2, metavar=('n_vars', 'order'),
                       help='Provides comprehensive information about the requested C matrix.')
   parser.add_argument('--oldC', type=int, nargs=2, metavar=('n_vars', 'order'),
@@ -132,7 +196,7 @@ if __name__ == "__main__":
   if not args.genC is None:
     n_vars = args.genC[0]
     order  = args.genC[1]
-    generateCmatrix(n_vars, order)
+    generateCmatrix(n_vars, order, args.workers)
 
   if not args.infoC is None:
     n_vars = args.infoC[0]
@@ -0,0 +1,107 @@
+# -----------------------------------------------------------------
+# Lazy C matrix
+# -----------------------------------------------------------------
+import numpy
+
+import c_sparse
+import multi_index
+
+# -----------------------------------------------------------------
+# C matrix whose rows are only computed the first time they are
+#  used, from the orders of the base and the table of expected
+#  three-way products of each dimension, and then memoized. The
+#  multiplications only use the rows of the non-zero coefficients
+#  of their first operand, so sparse polynomials never pay for the
+#  whole matrix.
+#
+# It has the same interface as the sparse C matrix. The operations
+#  that need all the elements (len, iteration) compute every row.
+#
+class c_lazy(c_sparse.c_sparse):
+  def __init__(self, base, orders, expected, squares):
+    self.base  = base
+    self.size  = len(base)
+    self.index = {base[n]: n for n in range(len(base))}
+
+    self.orders   = numpy.asarray(orders, dtype=numpy.int64).reshape(len(base), -1)
+    self.expected = expected
+    self.squares  = numpy.asarray(squares, dtype=numpy.float64)
+
+    # The orders are the graded multi-indices of the base, so the
+    #  position of each multi-index is given by its rank.
+    self.max_order     = self.expected.shape[0] - 1
+    self.multi_indices = [tuple(x) for x in self.orders.tolist()]
+    self.ranks         = multi_index.get_ranks(self.orders.shape[1], self.max_order)
+
+    # (j, k, values, codes) arrays of each computed row.
+    self.rows = {}
+
+  # Computes the non-zero elements of row i, sorted by (j, k), and the
+  #  codes of their (j, k) pairs. For each j, only the k that can give
+  #  a non-zero element are computed (see multi_index.get_products()).
+  def _compute_row(self, i):
+    row_j, row_k, row_values = [], [], []
+    for j in range(self.size):
+      k = products_of(self.multi_indices[i], self.multi_indices[j], self.ranks, self.max_order)
+      if len(k):
+        values = numpy.prod(self.expected[self.orders[i], self.orders[j], self.orders[k]], axis=1)
+        row_j.append(numpy.repeat(j, len(k)))
+        row_k.append(k)
+        row_values.append(values / self.squares[k])
+
+    j = numpy.concatenate(row_j).astype(numpy.int32) if row_j else numpy.zeros(0, dtype=numpy.int32)
+    k = numpy.concatenate(row_k).astype(numpy.int32) if row_k else numpy.zeros(0, dtype=numpy.int32)
+    values = numpy.concatenate(row_values) if row_values else numpy.zeros(0)
+    return j, k, values, numpy.asarray(j, dtype=numpy.int64)*self.size + k
+
+  # Returns the (j, k, values) arrays of the non-zero elements in row i.
+  def row(self, i):
+    i = int(i)
+    if not i in self.rows:
+      self.rows[i] = self._compute_row(i)
+    return self.rows[i][:3]
+
+  # Returns the value for the (i, j, k) triple of indexes.
+  def entry(self, i, j, k, default=0.0):
+    self.row(i)
+    codes = self.rows[int(i)][3]
+    code = numpy.int64(j)*self.size + k
+    position = numpy.searchsorted(codes, code)
+    if position < len(codes) and codes[position] == code:
+      return float(self.rows[int(i)][2][position])
+    return default
+
+  # Computes c[k] = sum(a[i]*b[j]*C[i, j, k]) for two dense coefficient
+  #  vectors over the base, using only the rows of the non-zero
+  #  elements of a.
+  def contract(self, a, b):
+    c = numpy.zeros(self.size)
+    for i in numpy.flatnonzero(a):
+      row_j, row_k, row_values = self.row(i)
+      if len(row_k):
+        c += numpy.bincount(row_k, weights=a[i]*b[row_j]*row_values, minlength=self.size)
+    return c
+
+  def __len__(self):
+    return sum(len(self.row(i)[0]) for i in range(self.size))
+
+  def iterkeys(self):
+    for i in range(self.size):
+      row_j, row_k, row_values = self.row(i)
+      for n in range(len(row_values)):
+        yield (self.base[i], self.base[row_j[n]], self.base[row_k[n]])
+
+  def iteritems(self):
+    for i in range(self.size):
+      row_j, row_k, row_values = self.row(i)
+      for n in range(len(row_values)):
+        yield ((self.base[i], self.base[row_j[n]], self.base[row_k[n]]), float(row_values[n]))
+
+# products_of(a, b, ranks, order)
+#
+# Returns the sorted array of the positions in the base of the
+#  multi-indices that can have a non-zero expected product with the
+#  multi-indices a and b.
+#
+def products_of(a, b, ranks, order):
+  return numpy.array(sorted([ranks[c] for c in multi_index.get_products(a, b, order)]), dtype=numpy.int64)
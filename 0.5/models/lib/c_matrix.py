@@ -1,86 +1,153 @@
-import os
 import uuid
 import itertools
-import pickle
+import logging
+import multiprocessing
 import time
+import numpy
 import sympy
 from math import factorial
-from collections import OrderedDict
 from sympy import integrate
-from sympy.abc import x
+
+import c_lazy
+import c_sparse
+import c_store
+import multi_index
+import orthopoly
+
+log = logging.getLogger(__name__)
+
+# Orders of the base and expected three-way products used by the
+#  workers populating the C matrix. They are set when the pool starts.
+_worker_orders   = None
+_worker_expected = None
+
+def _init_worker(orders, expected):
+  global _worker_orders, _worker_expected
+  _worker_orders   = orders
+  _worker_expected = expected
+
+def _populate_task(rows):
+  return populate_rows(_worker_orders, _worker_expected, rows)
+
+# populate_rows(orders, expected, rows)
+#
+# Computes the non-zero elements (i, j, k) of the C matrix with i in
+#  rows and i <= j <= k, before normalising them. Each element is the
+#  product along every dimension of the expected three-way products
+#  of the orders in the multi-indices. For a given (i, j) pair, only
+#  the k >= j that can give a non-zero element are computed, found by
+#  their rank (see multi_index.get_products()). The orders must be the
+#  graded multi-indices of the base. Returns the i, j, k and values
+#  arrays.
+#
+def populate_rows(orders, expected, rows):
+  order = expected.shape[0] - 1
+  ranks = multi_index.get_ranks(orders.shape[1], order)
+  multi_indices = [tuple(x) for x in orders.tolist()]
+
+  sorted_i, sorted_j, sorted_k, sorted_values = [], [], [], []
+  for i in rows:
+    for j in range(i, len(orders)):
+      k = c_lazy.products_of(multi_indices[i], multi_indices[j], ranks, order)
+      k = k[k >= j]
+      if len(k):
+        sorted_i.append(numpy.repeat(i, len(k)))
+        sorted_j.append(numpy.repeat(j, len(k)))
+        sorted_k.append(k)
+        sorted_values.append(numpy.prod(expected[orders[i], orders[j], orders[k]], axis=1))
+
+  i, j, k = [numpy.concatenate(x) if x else numpy.zeros(0, dtype=numpy.int64) for x in (sorted_i, sorted_j, sorted_k)]
+  values = numpy.concatenate(sorted_values) if sorted_values else numpy.zeros(0)
+  return i, j, k, values
 
 class c_matrix:
-  def __init__(self, vars, order):
+  # Polynomial family of the base, used to key the stored matrices.
+  family = 'legendre'
+
+  # If the matrix has to be generated, its rows are populated by a pool
+  #  of 'workers' processes. With no workers they are populated in the
+  #  calling process, which is required inside daemonic processes such
+  #  as the ones of other pools.
+  #
+  # If 'lazy' is set and the matrix is not stored, it is not generated.
+  #  Its rows are computed instead the first time they are used.
+  #
+  def __init__(self, vars, order, workers=None, lazy=False):
     self.vars  = vars
     self.order = order
-
-    preload_name = os.path.join(os.getcwd(),'preloads','d'+str(len(vars))+'o'+str(order)+'.pkl')
-    if os.path.isfile(preload_name):
-      tmp_var = ['___'+str(x)+'___' for x in range(len(vars))]
-      with open(preload_name, 'rb') as preload:
-        c_struct = pickle.load(preload)
-      # tmp_tuples = [(c_struct['vars'][i], tmp_var[i]) for i in range(len(vars))]
-      # tmp_base = [b.subs(tmp_tuples) for b in c_struct['base']]
-      # tmp_expectances = {x.subs(tmp_tuples): c_struct['expectances'][x] for x in c_struct['expectances']}
-      # tmp_matrix = {tuple([x[0].subs(tmp_tuples), x[1].subs(tmp_tuples), x[2].subs(tmp_tuples)]): c_struct['matrix'][x] for x in c_struct['matrix']}
-
-      # var_tuples = [(tmp_var[i], self.vars[i]) for i in range(len(vars))]
-      # self.base = [b.subs(var_tuples) for b in tmp_base]
-      # self.expectances = {x.subs(var_tuples): tmp_expectances[x] for x in tmp_expectances}
-      # self.matrix = {tuple([x[0].subs(var_tuples), x[1].subs(var_tuples), x[2].subs(var_tuples)]): tmp_matrix[x] for x in tmp_matrix}
-      self.base = c_struct['base']
-      self.matrix = c_struct['matrix']
-      self.expectances = c_struct['expectances']
+    self.workers = workers
+
+    # The stored data does not depend on the variables, they are bound
+    #  to it building the base from the stored orders.
+    c_struct = c_store.load(len(vars), order, self.family)
+    if c_struct is None and not lazy:
+      c_store.save(len(vars), order, self.family, self.generate_c_matrix(len(vars), order, self.workers))
+      c_struct = c_store.load(len(vars), order, self.family)
+
+    base_struct = self.generate_base(self.vars, self.order)
+    self.base = base_struct["Base"]
+    self.orders = base_struct["Orders"]
+
+    if c_struct is None:
+      squares = self.get_expected_base_squares(base_struct["Orders"])
+      self.matrix = c_lazy.c_lazy(self.base, base_struct["Orders"], self.get_expected_triples(order), squares)
     else:
-      self.matrix, self.base, self.expectances = self.generate_c_matrix(self.vars, self.order)
-
-      c_struct = {'vars': self.vars, 'base': self.base, 'expectances': self.expectances, 'matrix': self.matrix}
-      save_file = open(preload_name, 'wb')
-      pickle.dump(c_struct, save_file)
-      save_file.close()
+      if list(base_struct["Orders"]) != [tuple(x) for x in c_struct['orders']]:
+        raise ValueError("Stored C matrix for d%do%d does not match its base" % (len(vars), order))
+      squares = c_struct['squares']
+      self.matrix = c_sparse.c_sparse(self.base, c_struct['i'], c_struct['j'], c_struct['k'], c_struct['values'], is_sorted=True)
+
+    self.expectances = {self.base[n]: sympy.Float(squares[n]) for n in range(len(self.base))}
+
+    # Position of each element in the base, shared with the sparse matrix.
+    self.index = self.matrix.index
+
+  # Evaluates every element of the base at a set of points, given as
+  #  a matrix with one row per point and one column per variable, in
+  #  the order of vars. Returns a matrix with one row per point and
+  #  one column per element of the base. The polynomials of each
+  #  variable are evaluated numerically and multiplied following the
+  #  orders of the base, without substituting in the expressions.
+  def evaluate_base(self, points):
+    points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, len(self.vars))
+    # The base is built with the variables in reverse order.
+    values = orthopoly.evaluate(self.family, self.order, points[:, ::-1])
+    orders = numpy.array(self.orders, dtype=numpy.int64).reshape(len(self.orders), len(self.vars))
+    result = numpy.ones((len(points), len(orders)))
+    for d in range(orders.shape[1]):
+      result *= values[orders[:, d], :, d].T
+    return result
+
+  # Evaluates a PCE expansion, given as a dict of coefficients keyed by
+  #  expressions, at a set of points as in evaluate_base. The terms
+  #  that are not part of the base are lambdified.
+  def evaluate_expansion(self, expansion, points):
+    points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, len(self.vars))
+    coeffs = numpy.zeros(len(self.base))
+    result = numpy.zeros(len(points))
+    for term, value in expansion.iteritems():
+      if term in self.index:
+        coeffs[self.index[term]] += float(value)
+      else:
+        function = sympy.lambdify(self.vars, term, 'numpy')
+        result += float(value) * numpy.asarray(function(*points.T), dtype=numpy.float64)
+    return result + self.evaluate_base(points).dot(coeffs)
 
   # Generates the Legendre polynomials for variable x up to the given order.
   # var is expected to be a symbolic value from sympy.abc
-  # order is expected to be an integer value between 0 and 10
+  # order is expected to be a non-negative integer value
   
   def get_legendres(self, order, var):
-    coeffs = [[sympy.S(1.0)], [sympy.S(0.0), sympy.S(1.0)], [sympy.S(-1.0/2), sympy.S(0.0), sympy.S(3.0/2)], [sympy.S(0.0), sympy.S(-3.0/2), sympy.S(0.0), sympy.S(5.0/2)], \
-    [sympy.S(3.0/8), sympy.S(0.0), sympy.S(-30.0/8), sympy.S(0.0), sympy.S(35.0/8)], [sympy.S(0.0), sympy.S(15.0/8), sympy.S(0.0), sympy.S(-70.0/8), sympy.S(0.0), sympy.S(63.0/8)], \
-    [sympy.S(-5.0/16), sympy.S(0.0), sympy.S(105.0/16), sympy.S(0.0), sympy.S(-315.0/16), sympy.S(0.0), sympy.S(231.0/16)], \
-    [sympy.S(0.0), sympy.S(-35.0/16), sympy.S(0.0), sympy.S(315.0/16), sympy.S(0.0), sympy.S(-693.0/16), sympy.S(0.0), sympy.S(429.0/16)], \
-    [sympy.S(35.0/128), sympy.S(0.0), sympy.S(-1260.0/128), sympy.S(0.0), sympy.S(6930.0/128), sympy.S(0.0), sympy.S(-12012.0/128), sympy.S(0.0), sympy.S(6435.0/128)], \
-    [sympy.S(0.0), sympy.S(315.0/128), sympy.S(0.0), sympy.S(-4620.0/128), sympy.S(0.0), sympy.S(18018.0/128), sympy.S(0.0), sympy.S(-25740.0/128), sympy.S(0.0), sympy.S(12155.0/128)], \
-    [sympy.S(-63.0/256), sympy.S(0.0), sympy.S(3465.0/256), sympy.S(0.0), sympy.S(-30030.0/256), sympy.S(0.0), sympy.S(90090.0/256), sympy.S(0.0), sympy.S(-109395.0/256), sympy.S(0.0), sympy.S(46189.0/256)]]
-
-    pows = [sympy.S(1.0)]
-    for i in (range(order+1))[1:]:
-      pows.append(var**i)
-
-    legendres = []
-    for i in range(order+1):
-      tuples = zip(pows, coeffs[i])
-      current = []
-      for j in tuples:
-        current.append(j[0]*j[1])
-      legendres.append(sum(current))
-
-    return legendres
+    return list(orthopoly.get_polynomials(self.family, order, var))
 
   # Generates a list of tuples with the order of each polynome in every 
   # element of the base  
   def get_orders_for_base(self, dim, order):
-    # Get all combinations for the orders.
-    valid = []
-    # Iteratively choose increasing sums or orders.
-    for i in range(order+1):
-      for j in itertools.product(range(order+1), repeat=dim):
-        if sum(j) == i:
-          valid.append(j)
-    return valid
+    return list(multi_index.get_orders(dim, order))
 
   # Returns the size of the base
   def get_base_size(self, dim, order):
-    return (factorial(dim+order)/(factorial(dim)*factorial(order)))
+    return multi_index.count(dim, order)
 
   # Generates a struct with the base for a given set of variables with the
   # specified order.
@@ -99,63 +166,88 @@ class c_matrix:
       base.append(current)
     return {"Base": base, "Orders": base_orders}
 
-  def generate_c_matrix(self, vars, order):
-    print "Generating base (%dx%d)" % (len(vars), order)
-    base_struct = self.generate_base(vars, order)
-    base = base_struct["Base"]
-    base_orders = base_struct["Orders"]
-
-    x_legendre = self.get_legendres(order, x)
-    indexes_3x3 = list(itertools.product(range(order+1), repeat=3))
-    all_indexes_expected = list(OrderedDict.fromkeys(indexes_3x3))
-    for i in range(len(indexes_3x3)):
-      indexes_3x3[i] = tuple(sorted(indexes_3x3[i]))
-    unique_indexes_3x3 = list(OrderedDict.fromkeys(indexes_3x3))
-
-    print "Calculating Expected Three-way Products"
-    expected = {}
-    for i in unique_indexes_3x3:
-      value = (1.0/2)*(integrate(x_legendre[i[0]]*x_legendre[i[1]]*x_legendre[i[2]], (x, -1, 1)))
-      if value != 0:
-        expected[i] = value
+  # Computes the expected value of the product of three Legendre polynomials
+  #  of orders a, b and c on a variable uniformly distributed in [-1, 1] for
+  #  all the combinations of orders up to the given one. The values come from
+  #  the closed form of the integral (Adams, 1878):
+  #
+  #     E[P_a*P_b*P_c] = A(s-a)*A(s-b)*A(s-c) / ((2s+1)*A(s)),  2s = a+b+c
+  #
+  #  with A(n) = (2n)!/(2^n*n!)^2. The expectation is zero when a+b+c is odd
+  #  or when the orders do not satisfy the triangle inequality.
+  def get_expected_triples(self, order):
+    a_n = [float(factorial(2*n)) / ((2**n)*factorial(n))**2 for n in range(3*order+1)]
+    expected = numpy.zeros((order+1, order+1, order+1))
+    for (a, b, c) in itertools.product(range(order+1), repeat=3):
+      if (a + b + c) % 2 == 1 or a > b + c or b > a + c or c > a + b:
+        continue
+      s = (a + b + c) / 2
+      expected[a, b, c] = a_n[s-a]*a_n[s-b]*a_n[s-c] / ((2*s + 1)*a_n[s])
+    return expected
+
+  # Computes the expected value of the square of each element of the base,
+  #  given the orders of its polynomials. Since E[P_n^2] = 1/(2n+1) for each
+  #  of the variables, the result is the product along every dimension.
+  def get_expected_base_squares(self, base_orders):
+    orders = numpy.array(base_orders, dtype=numpy.int64)
+    return 1.0 / numpy.prod(2*orders + 1, axis=1)
+
+  # Generates the data of the C matrix for the given dimension and
+  #  order: the orders of the base, the (i, j, k, values) arrays of the
+  #  non-zero elements and the expected squares of the base terms.
+  def generate_c_matrix(self, dim, order, workers=None):
+    log.info("Generating base orders (%dx%d)", dim, order)
+    base_orders = self.get_orders_for_base(dim, order)
+    base = range(len(base_orders))
+
+    log.info("Calculating Expected Three-way Products")
+    expected = self.get_expected_triples(order)
 
     # Calculate Expected Base Squares
-    print "Calculating Expected Base Squares"
-    expected_base_squares = []
-    for i in range(len(base)):
-      if i % 100 == 0:
-        print "Value %d in %d" % (i, len(base))
-      expected_base_square = base[i]*base[i]
-      for n in vars:
-        expected_base_square = (1.0/2)*(integrate(expected_base_square, (n, -1, 1)))
-      expected_base_squares.append(expected_base_square)
-
-    print "Populating C Matrix"
-    c_matrix = {}
-    iters = 1
-    for i in itertools.combinations_with_replacement(range(len(base)), 3):
-      if iters % 1000 == 0:
-        print "Value %d" % (iters)
-      iters += 1
-      calculated_value = 1.0
-      for j in range(len(vars)):
-        if sum([base_orders[i[0]][j], base_orders[i[1]][j], base_orders[i[2]][j]]) % 2 == 1:
-          break
-        t = tuple(sorted((base_orders[i[0]][j], base_orders[i[1]][j], base_orders[i[2]][j])))
-        calculated_value *= expected.get(t, 0.0)
-        if calculated_value == 0.0:
-          break
-      else:
-        perms = list(OrderedDict.fromkeys(list(itertools.permutations([i[0],i[1],i[2]]))))
-        for p in perms:
-          c_key = (base[p[0]], base[p[1]], base[p[2]])
-          c_matrix[c_key] = calculated_value / expected_base_squares[p[2]]
-
-    sqr_base_expectances = {}
-    for i in range(len(base)):
-      sqr_base_expectances[base[i]] = expected_base_squares[i]
-
-    return c_matrix, base, sqr_base_expectances
+    log.info("Calculating Expected Base Squares")
+    expected_base_squares = self.get_expected_base_squares(base_orders)
+
+    # The rows are split in chunks, taking every n-th row so all the
+    #  chunks have a similar amount of (i, j) pairs, and the partial
+    #  arrays of each chunk are concatenated at the end.
+    log.info("Populating C Matrix")
+    orders = numpy.array(base_orders, dtype=numpy.int64)
+    n_chunks = min(len(base), 4*workers if workers else 10)
+    chunks = [range(n, len(base), n_chunks) for n in range(n_chunks)]
+    parts = []
+    if workers:
+      pool = multiprocessing.Pool(workers, _init_worker, (orders, expected))
+      try:
+        for part in pool.imap_unordered(_populate_task, chunks):
+          parts.append(part)
+          log.info("Chunk %d in %d", len(parts), n_chunks)
+        pool.close()
+      except:
+        pool.terminate()
+        raise
+      finally:
+        pool.join()
+    else:
+      for chunk in chunks:
+        parts.append(populate_rows(orders, expected, chunk))
+        log.info("Chunk %d in %d", len(parts), n_chunks)
+
+    # Every permutation of a sorted triple shares the same expectation,
+    #  normalised by the expected square of the base term in the last
+    #  position. Repeated permutations are dropped by the sparse matrix.
+    i, j, k, values = [numpy.concatenate(x) for x in zip(*parts)]
+    perms = list(itertools.permutations([i, j, k]))
+    all_i = numpy.concatenate([p[0] for p in perms])
+    all_j = numpy.concatenate([p[1] for p in perms])
+    all_k = numpy.concatenate([p[2] for p in perms])
+    all_values = numpy.tile(values, len(perms)) / expected_base_squares[all_k]
+
+    # Sort the triples and drop the repeated ones before storing them.
+    c_matrix = c_sparse.c_sparse(base, all_i, all_j, all_k, all_values)
+
+    return {'orders': numpy.array(base_orders, dtype=numpy.int32).reshape(len(base_orders), dim),
+            'i': c_matrix.i, 'j': c_matrix.j, 'k': c_matrix.k, 'values': c_matrix.values,
+            'squares': expected_base_squares}
 
 class c_matrix_direct:
   def __init__(self, vars, order):
@@ -196,41 +288,14 @@ class c_matrix_direct:
     return {"Base": base, "Orders": base_orders}
 
   def get_legendres(self, order, var):
-    coeffs = [[sympy.S(1.0)], [sympy.S(0.0), sympy.S(1.0)], [sympy.S(-1.0/2), sympy.S(0.0), sympy.S(3.0/2)], [sympy.S(0.0), sympy.S(-3.0/2), sympy.S(0.0), sympy.S(5.0/2)], \
-    [sympy.S(3.0/8), sympy.S(0.0), sympy.S(-30.0/8), sympy.S(0.0), sympy.S(35.0/8)], [sympy.S(0.0), sympy.S(15.0/8), sympy.S(0.0), sympy.S(-70.0/8), sympy.S(0.0), sympy.S(63.0/8)], \
-    [sympy.S(-5.0/16), sympy.S(0.0), sympy.S(105.0/16), sympy.S(0.0), sympy.S(-315.0/16), sympy.S(0.0), sympy.S(231.0/16)], \
-    [sympy.S(0.0), sympy.S(-35.0/16), sympy.S(0.0), sympy.S(315.0/16), sympy.S(0.0), sympy.S(-693.0/16), sympy.S(0.0), sympy.S(429.0/16)], \
-    [sympy.S(35.0/128), sympy.S(0.0), sympy.S(-1260.0/128), sympy.S(0.0), sympy.S(6930.0/128), sympy.S(0.0), sympy.S(-12012.0/128), sympy.S(0.0), sympy.S(6435.0/128)], \
-    [sympy.S(0.0), sympy.S(315.0/128), sympy.S(0.0), sympy.S(-4620.0/128), sympy.S(0.0), sympy.S(18018.0/128), sympy.S(0.0), sympy.S(-25740.0/128), sympy.S(0.0), sympy.S(12155.0/128)], \
-    [sympy.S(-63.0/256), sympy.S(0.0), sympy.S(3465.0/256), sympy.S(0.0), sympy.S(-30030.0/256), sympy.S(0.0), sympy.S(90090.0/256), sympy.S(0.0), sympy.S(-109395.0/256), sympy.S(0.0), sympy.S(46189.0/256)]]
-
-    pows = [sympy.S(1.0)]
-    for i in (range(order+1))[1:]:
-      pows.append(var**i)
-
-    legendres = []
-    for i in range(order+1):
-      tuples = zip(pows, coeffs[i])
-      current = []
-      for j in tuples:
-        current.append(j[0]*j[1])
-      legendres.append(sum(current))
-
-    return legendres
+    return list(orthopoly.get_polynomials('legendre', order, var))
 
   def get_orders_for_base(self, dim, order):
-    # Get all combinations for the orders.
-    valid = []
-    # Iteratively choose increasing sums or orders.
-    for i in range(order+1):
-      for j in itertools.product(range(order+1), repeat=dim):
-        if sum(j) == i:
-          valid.append(j)
-    return valid
+    return list(multi_index.get_orders(dim, order))
 
   # Returns the size of the base
   def get_base_size(self, dim, order):
-    return (factorial(dim+order)/(factorial(dim)*factorial(order)))
+    return multi_index.count(dim, order)
 
 class allAboutTheBase(object):
   def __init__(self, variables, order):
@@ -254,39 +319,12 @@ class allAboutTheBase(object):
     return {"Base": base, "Orders": base_orders}
 
   def get_legendres(self, order, var):
-    coeffs = [[sympy.S(1.0)], [sympy.S(0.0), sympy.S(1.0)], [sympy.S(-1.0/2), sympy.S(0.0), sympy.S(3.0/2)], [sympy.S(0.0), sympy.S(-3.0/2), sympy.S(0.0), sympy.S(5.0/2)], \
-    [sympy.S(3.0/8), sympy.S(0.0), sympy.S(-30.0/8), sympy.S(0.0), sympy.S(35.0/8)], [sympy.S(0.0), sympy.S(15.0/8), sympy.S(0.0), sympy.S(-70.0/8), sympy.S(0.0), sympy.S(63.0/8)], \
-    [sympy.S(-5.0/16), sympy.S(0.0), sympy.S(105.0/16), sympy.S(0.0), sympy.S(-315.0/16), sympy.S(0.0), sympy.S(231.0/16)], \
-    [sympy.S(0.0), sympy.S(-35.0/16), sympy.S(0.0), sympy.S(315.0/16), sympy.S(0.0), sympy.S(-693.0/16), sympy.S(0.0), sympy.S(429.0/16)], \
-    [sympy.S(35.0/128), sympy.S(0.0), sympy.S(-1260.0/128), sympy.S(0.0), sympy.S(6930.0/128), sympy.S(0.0), sympy.S(-12012.0/128), sympy.S(0.0), sympy.S(6435.0/128)], \
-    [sympy.S(0.0), sympy.S(315.0/128), sympy.S(0.0), sympy.S(-4620.0/128), sympy.S(0.0), sympy.S(18018.0/128), sympy.S(0.0), sympy.S(-25740.0/128), sympy.S(0.0), sympy.S(12155.0/128)], \
-    [sympy.S(-63.0/256), sympy.S(0.0), sympy.S(3465.0/256), sympy.S(0.0), sympy.S(-30030.0/256), sympy.S(0.0), sympy.S(90090.0/256), sympy.S(0.0), sympy.S(-109395.0/256), sympy.S(0.0), sympy.S(46189.0/256)]]
-
-    pows = [sympy.S(1.0)]
-    for i in (range(order+1))[1:]:
-      pows.append(var**i)
-
-    legendres = []
-    for i in range(order+1):
-      tuples = zip(pows, coeffs[i])
-      current = []
-      for j in tuples:
-        current.append(j[0]*j[1])
-      legendres.append(sum(current))
-
-    return legendres
+    return list(orthopoly.get_polynomials('legendre', order, var))
 
   def get_orders_for_base(self, dim, order):
-    # Get all combinations for the orders.
-    valid = []
-    # Iteratively choose increasing sums or orders.
-    for i in range(order+1):
-      for j in itertools.product(range(order+1), repeat=dim):
-        if sum(j) == i:
-          valid.append(j)
-    return valid
+    return list(multi_index.get_orders(dim, order))
 
   # Returns the size of the base
   def get_base_size(self, dim, order):
-    return (factorial(dim+order)/(factorial(dim)*factorial(order)))
+    return multi_index.count(dim, order)
     
\ No newline at end of file
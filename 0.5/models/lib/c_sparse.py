@@ -0,0 +1,146 @@
+# -----------------------------------------------------------------
+# Sparse C matrix
+# -----------------------------------------------------------------
+import numpy
+
+# -----------------------------------------------------------------
+# Sparse storage of the non-zero elements of a C matrix. The terms
+#  of the base are referred to by their position in it, and the
+#  non-zero (i, j, k) triples are kept as flat NumPy arrays sorted
+#  by (i, j, k), so all the elements in row i are the slice
+#  [row_pointers[i], row_pointers[i+1]) of the arrays (CSR-like).
+#
+# The object also behaves as a read-only dictionary keyed by tuples
+#  of three base expressions, so code written for the old dict
+#  representation keeps working.
+#
+# If the triples are already sorted and unique ('is_sorted'), as the
+#  ones read from the C matrix store, the arrays are used as they are,
+#  so memory-mapped arrays are never copied.
+#
+class c_sparse:
+  def __init__(self, base, i, j, k, values, is_sorted=False):
+    self.base  = base
+    self.size  = len(base)
+    self.index = {base[n]: n for n in range(len(base))}
+
+    i = numpy.asarray(i, dtype=numpy.int32)
+    j = numpy.asarray(j, dtype=numpy.int32)
+    k = numpy.asarray(k, dtype=numpy.int32)
+    values = numpy.asarray(values, dtype=numpy.float64)
+
+    if is_sorted:
+      self.i      = i
+      self.j      = j
+      self.k      = k
+      self.values = values
+      self.codes  = None
+    else:
+      # Sort the triples and drop the repeated ones, keeping the first.
+      codes = self._encode(i, j, k)
+      codes, unique = numpy.unique(codes, return_index=True)
+
+      self.i      = i[unique]
+      self.j      = j[unique]
+      self.k      = k[unique]
+      self.values = values[unique]
+      self.codes  = codes
+    self.row_pointers = numpy.searchsorted(self.i, numpy.arange(self.size + 1))
+
+  # Packs an (i, j, k) triple in a single integer preserving the order.
+  def _encode(self, i, j, k):
+    size = numpy.int64(self.size)
+    return (numpy.asarray(i, dtype=numpy.int64)*size + j)*size + k
+
+  # Returns the value for the (i, j, k) triple of indexes.
+  def entry(self, i, j, k, default=0.0):
+    if self.codes is None:
+      self.codes = self._encode(self.i, self.j, self.k)
+    code = self._encode(i, j, k)
+    position = numpy.searchsorted(self.codes, code)
+    if position < len(self.codes) and self.codes[position] == code:
+      return float(self.values[position])
+    return default
+
+  # Returns the (j, k, values) arrays of the non-zero elements in row i.
+  def row(self, i):
+    start, end = self.row_pointers[i], self.row_pointers[i+1]
+    return self.j[start:end], self.k[start:end], self.values[start:end]
+
+  # Computes c[k] = sum(a[i]*b[j]*C[i, j, k]) for two dense coefficient
+  #  vectors over the base. Only the rows of the non-zero elements of a
+  #  are gathered, and they are all reduced at once.
+  def contract(self, a, b):
+    rows = numpy.flatnonzero(a)
+    starts  = self.row_pointers[rows]
+    lengths = self.row_pointers[rows + 1] - starts
+    total = lengths.sum()
+    if total == 0:
+      return numpy.zeros(self.size)
+
+    # Positions of all the elements in the gathered rows.
+    offsets = numpy.cumsum(lengths) - lengths
+    positions = numpy.repeat(starts - offsets, lengths) + numpy.arange(total)
+
+    weights = a[self.i[positions]] * b[self.j[positions]] * self.values[positions]
+    return numpy.bincount(self.k[positions], weights=weights, minlength=self.size)
+
+  # Returns the indexes of a tuple of base expressions, or None if
+  #  any of them is not part of the base.
+  def indexes_of(self, key):
+    try:
+      return tuple(self.index[x] for x in key)
+    except (KeyError, TypeError):
+      return None
+
+  def get(self, key, default=0.0):
+    indexes = self.indexes_of(key)
+    if indexes is None:
+      return default
+    return self.entry(indexes[0], indexes[1], indexes[2], default)
+
+  def __getitem__(self, key):
+    value = self.get(key, None)
+    if value is None:
+      raise KeyError(key)
+    return value
+
+  def __contains__(self, key):
+    return self.get(key, None) is not None
+
+  def __len__(self):
+    return len(self.values)
+
+  def __iter__(self):
+    return self.iterkeys()
+
+  def iterkeys(self):
+    for n in range(len(self.values)):
+      yield (self.base[self.i[n]], self.base[self.j[n]], self.base[self.k[n]])
+
+  def iteritems(self):
+    for n in range(len(self.values)):
+      yield ((self.base[self.i[n]], self.base[self.j[n]], self.base[self.k[n]]), float(self.values[n]))
+
+  def keys(self):
+    return list(self.iterkeys())
+
+  def items(self):
+    return list(self.iteritems())
+
+  # Builds the dictionary representation of the matrix.
+  def to_dict(self):
+    return dict(self.iteritems())
+
+# from_dict(matrix, base)
+#
+# Builds the sparse representation of a C matrix stored as a dict
+#  keyed by tuples of base expressions.
+#
+def from_dict(matrix, base):
+  index = {base[n]: n for n in range(len(base))}
+  triples = [(index[key[0]], index[key[1]], index[key[2]], float(value)) for key, value in matrix.iteritems()]
+  if not triples:
+    return c_sparse(base, [], [], [], [])
+  i, j, k, values = zip(*triples)
+  return c_sparse(base, i, j, k, values)
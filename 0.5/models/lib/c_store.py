@@ -0,0 +1,89 @@
+# -----------------------------------------------------------------
+# C matrix store
+# -----------------------------------------------------------------
+import os
+import shutil
+import hashlib
+import tempfile
+import numpy
+
+# Version of the stored data. Changing it makes every stored entry
+#  unreachable, so they are generated again.
+FORMAT = 2
+
+# Arrays of an entry and their types. Each one is stored in its own
+#  .npy file in the directory of the entry.
+ARRAYS = [('orders', numpy.int32), ('i', numpy.int32), ('j', numpy.int32), ('k', numpy.int32),
+          ('values', numpy.float64), ('squares', numpy.float64)]
+
+# -----------------------------------------------------------------
+# Persistent store of C matrices shared by every model instance and
+#  worker process. The entries are keyed by the dimension, the order
+#  and the polynomial family of the base, and they only hold integer
+#  indexed data (the orders of the base terms, the (i, j, k, value)
+#  arrays of the non-zero elements and the expected squares of the
+#  base), so they can be bound to any set of variables.
+#
+# The arrays are opened memory-mapped and read-only, so loading an
+#  entry takes no time and every process using it shares its pages.
+#
+# The store lives in the directory given by the HOPLITE_PRELOADS
+#  environment variable or, by default, in the 'preloads' directory
+#  of the framework, whatever the working directory is.
+#
+
+# get_directory()
+#
+# Returns the directory of the store.
+#
+def get_directory():
+  directory = os.environ.get('HOPLITE_PRELOADS', None)
+  if directory is None:
+    directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'preloads')
+  return os.path.abspath(directory)
+
+# get_path(dim, order, family)
+#
+# Returns the path of the entry for the given key. Its name is the
+#  digest of the key, so different families or formats never clash.
+#
+def get_path(dim, order, family):
+  digest = hashlib.sha1(repr(('c_matrix', FORMAT, family, int(dim), int(order)))).hexdigest()
+  return os.path.join(get_directory(), family + '_d' + str(dim) + 'o' + str(order) + '_' + digest[:16])
+
+# load(dim, order, family)
+#
+# Returns the stored arrays for the given key, memory-mapped, or None
+#  if they have not been stored yet.
+#
+def load(dim, order, family):
+  path = get_path(dim, order, family)
+  if not os.path.isdir(path):
+    return None
+  return {name: numpy.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name, dtype in ARRAYS}
+
+# save(dim, order, family, data)
+#
+# Stores the arrays for the given key. They are written to a temporary
+#  directory that is then renamed, so concurrent readers never see a
+#  partial entry. If another process stores the entry first, its copy
+#  is kept.
+#
+def save(dim, order, family, data):
+  path = get_path(dim, order, family)
+  directory = os.path.dirname(path)
+  try:
+    os.makedirs(directory)
+  except OSError:
+    if not os.path.isdir(directory):
+      raise
+
+  tmp_path = tempfile.mkdtemp(dir=directory, suffix='.tmp')
+  try:
+    for name, dtype in ARRAYS:
+      numpy.save(os.path.join(tmp_path, name + '.npy'), numpy.ascontiguousarray(data[name], dtype=dtype))
+    os.rename(tmp_path, path)
+  except:
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    if not os.path.isdir(path):
+      raise
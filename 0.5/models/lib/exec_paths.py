@@ -0,0 +1,270 @@
+# -----------------------------------------------------------------
+# Execution paths
+# -----------------------------------------------------------------
+import graph_view
+
+# get_execution_paths(source)
+#
+# Goes over the system graph getting the different execution paths
+#  in it. It takes care of generating the paths, eliminating the dead
+#  code and annotating the dependence chains of the different
+#  flow-control nodes so that we can later compute the probabilities
+#  of each path. Returns a list of dicts with the 'decisions' taken in
+#  the forks of the path, the 'path' graph and its 'cmp_trees', the
+#  graphs with the 'nodes' that each cmp node depends on.
+#
+# The choices in the forks are enumerated depth-first over the basic
+#  blocks, and only the forks that can still be reached are branched
+#  on. The paths are only built once their basic blocks are known to
+#  be different from the ones of the paths found before.
+#
+def get_execution_paths(source):
+  # Get all the BBs that have a conditional branch and, thus, a fork.
+  all_branches = [x for x in source['nodes'] if source['nodes'][x]['op'] == 'br']
+  cond_branches = [x for x in all_branches if not source['nodes'][source['nodes'][x]['preds'][0]]['cmp'] in ['TRUE', 'FALSE']]
+
+  forks = {}
+  for c in cond_branches:
+    for bb in source['bbs']:
+      if c in source['bbs'][bb]['nodes']: forks[bb] = source['bbs'][bb]['succs']
+  forks_list = sorted(forks.keys())
+
+  # Depth-first enumeration of the choices, taking the first direction
+  #  first, so the paths come in the same order as when all the
+  #  combinations of choices are enumerated. A fork that is not
+  #  reachable with the choices taken so far is not reachable with any
+  #  of the following ones either, so unless its successors are also
+  #  successors of the first BB, both directions lead to the same path
+  #  and only the first one is taken.
+  leaves = []
+  found = set()
+  pending = [()]
+  while pending:
+    choices = pending.pop()
+    alive, entry_succs = get_alive_bbs(source['bbs'], forks_list, choices)
+    if len(choices) == len(forks_list):
+      key = tuple((f, choices[f]) for f in range(len(forks_list)) if forks_list[f] in alive)
+      if not key in found:
+        found.add(key)
+        leaves.append(choices)
+      continue
+    fork = forks_list[len(choices)]
+    if fork in alive or [x for x in source['bbs'][fork]['succs'] if x in entry_succs]:
+      pending.append(choices + (1,))
+    pending.append(choices + (0,))
+
+  paths = []
+  for choices in leaves:
+    path = build_path(source, forks_list, choices)
+    # Insert the path only if it was not there before.
+    if not path['decisions'] in [x['decisions'] for x in paths]:
+      paths.append(path)
+
+  return paths
+
+# get_alive_bbs(bbs, forks_list, choices)
+#
+# Returns the set of basic blocks that are not removed as unreachable
+#  when the direction given by each choice is deleted from the first
+#  forks, together with the successors left to the first BB. The forks
+#  without a choice keep both directions.
+#
+def get_alive_bbs(bbs, forks_list, choices):
+  succs = {bb: list(bbs[bb]['succs']) for bb in bbs}
+  for f in range(len(choices)):
+    s = succs[forks_list[f]][choices[f]]
+    del succs[forks_list[f]][choices[f]]
+    if s in succs[0]:
+      del succs[0][succs[0].index(s)]
+  entry_succs = list(succs[0])
+
+  preds = {bb: [] for bb in succs}
+  for bb in succs:
+    for bs in succs[bb]:
+      preds[bs].append(bb)
+
+  deleted_bbs = True
+  while deleted_bbs:
+    deleted_bbs = False
+    for bb in [x for x in succs if not preds[x]]:
+      for bs in succs[bb]:
+        preds[bs].remove(bb)
+      del succs[bb]
+      del preds[bb]
+      deleted_bbs = True
+
+  return set(succs), entry_succs
+
+# build_path(source, forks_list, choices)
+#
+# Builds the execution path that takes, in each fork of forks_list,
+#  the direction not deleted by its choice. The path shares the nodes
+#  and BBs that it does not change with the source graph.
+#
+def build_path(source, forks_list, choices):
+  lc = list(choices)
+  new_path = graph_view.derive(source)
+  nodes = new_path['nodes']
+  bbs = new_path['bbs']
+
+  # Step 1: Transform all forks in execution paths into
+  #  univocal paths by leaving every BB with just one
+  #  successor.
+  for f in range(len(forks_list)):
+    succs = list(bbs[forks_list[f]]['succs'])
+    s = succs[lc[f]]
+    del succs[lc[f]]
+    graph_view.update(bbs, forks_list[f], succs=succs)
+    if s in bbs[0]['succs']:
+      succs = list(bbs[0]['succs'])
+      del succs[succs.index(s)]
+      graph_view.update(bbs, 0, succs=succs)
+
+  # At this point, only Basic Block successors information is
+  #  reliable. The predecessors info has to be corrected, and
+  #  the branch and phi nodes will dissapear since now they
+  #  will always go to and come from the same path.
+
+  # Step 2: Clear all predecessors information from the BBs.
+  for bb in list(bbs):
+    graph_view.update(bbs, bb, preds=[])
+
+  # Step 3: Rebuild the precessors info with the successors one.
+  #  The new lists of predecessors belong to the path, so they can be
+  #  modified in place from now on.
+  for bb in bbs:
+    for bs in bbs[bb]['succs']:
+      bbs[bs]['preds'].append(bb)
+
+  # Step 4: Eliminate all unreachable BBs. That implies
+  #  removing the BB as well as all its nodes.
+  #  In the process, annotate the nodes that will
+  #  be deleted afterwards.
+  nodes_to_delete = []
+  deleted_bbs = True
+  while deleted_bbs:
+    deleted_bbs = False
+    for bb in [x for x in bbs if not bbs[x]['preds']]:
+      nodes_to_delete += bbs[bb]['nodes']
+      for bs in bbs[bb]['succs']:
+        bbs[bs]['preds'].remove(bb)
+      del bbs[bb]
+      deleted_bbs = True
+
+  # Step 5: Transform all phi nodes in bypass nodes.
+  #  Bypass nodes are a temporary concept intended to
+  #  just eliminate the input pairs and the multiple
+  #  possible sources.
+  #  All bypass nodes have 1 pred and N succs.
+  for n in [x for x in nodes if nodes[x]['op'] == 'phi']:
+    for p in nodes[n]['preds']:
+      if p[0] in bbs:
+        new_preds = [p[1]]
+        break
+    graph_view.update(nodes, n, op='bypass', preds=new_preds)
+
+  # Step 6: Remove all bypass nodes.
+  for n in [x for x in nodes if nodes[x]['op'] == 'bypass']:
+    # Add all successors of the node as successors of the predecessor.
+    p = nodes[n]['preds'][0]
+    succs = nodes[p]['succs'] + nodes[n]['succs']
+    succs.remove(n)
+    graph_view.update(nodes, p, succs=succs)
+
+    # Replace the node in the predecessors lists of all its successors
+    #  with its predecessor.
+    for s in nodes[n]['succs']:
+      graph_view.update(nodes, s, preds=[p if x == n else x for x in nodes[s]['preds']])
+
+    # And delete the node once and for all.
+    del nodes[n]
+
+  # Step 7: Delete branches.
+  for n in [x for x in nodes if nodes[x]['op'] == 'br']:
+    p = nodes[n]['preds'][0]
+    succs = list(nodes[p]['succs'])
+    succs.remove(n)
+    graph_view.update(nodes, p, succs=succs)
+    del nodes[n]
+
+  # Step 8: Save the branch-related CMP operations for later study.
+  cmp_trees = {}
+  for n in [x for x in nodes
+      if (nodes[x]['op'] == 'cmp' and
+        not nodes[x]['cmp'] in ['TRUE', 'FALSE'] and
+        not nodes[x]['succs'])]:
+    cmp_trees[n] = {'nodes': get_subgraph_for(n, nodes)}
+
+  # Step 9: Delete all hanging nodes: Those that are not outputs
+  #  but have no successors. They are dead code that has to be
+  #  eliminated.
+  while nodes_to_delete:
+    while nodes_to_delete:
+      n = nodes_to_delete.pop()
+      if n in nodes:
+        del nodes[n]
+    drop_missing(nodes, 'succs', nodes)
+    nodes_to_delete += [x for x in nodes
+      if (not nodes[x]['op'] == 'output' and
+          not nodes[x]['succs'])]
+
+  # 9.2: Remove all deleted nodes from their corresponding BBs.
+  drop_missing(bbs, 'nodes', nodes)
+
+  # 9.3: Update inputs and outputs information.
+  new_path['inputs']  = [x for x in new_path['inputs']  if x in nodes]
+  new_path['outputs'] = [x for x in new_path['outputs'] if x in nodes]
+
+  # Step 10: Pack everything, wrap it nicely and return it.
+
+  # 10.1: Match cmp nodes with their BBs
+  cmps_for_bbs = {}
+  for n in cmp_trees.keys():
+    bb_list = [x for x in source['bbs'] if n in source['bbs'][x]['nodes']]
+    if bb_list:
+      cmps_for_bbs[bb_list[0]] = n
+
+  # 10.2: Retrieve the information of the decision taken in
+  #  each decisor.
+  decisions = {}
+  for i in range(len(forks_list)):
+    if forks_list[i] in bbs:
+      # The selections are inverted because lc holds the
+      #  directions that got deleted.
+      decisions[cmps_for_bbs[forks_list[i]]] = {0: False, 1: True}[lc[i]]
+
+  return {'decisions': decisions, 'path': new_path, 'cmp_trees': cmp_trees}
+
+# drop_missing(entries, field, present)
+#
+# Removes from the given list field of the entries the ids that are not
+#  in present. Only the entries that change are replaced.
+#
+def drop_missing(entries, field, present):
+  for key in list(entries):
+    kept = [x for x in entries[key][field] if x in present]
+    if len(kept) != len(entries[key][field]):
+      graph_view.update(entries, key, **{field: kept})
+
+# get_subgraph_for(node_id, graph)
+#
+# Returns the subgraph with all the nodes that precede node_id in the
+#  given nodes, sharing the nodes whose successors do not change.
+#
+def get_subgraph_for(node_id, graph):
+  # Generate list of all the predecessors of the node node_id
+  op_preds = set()
+  new_preds = [node_id]
+  while new_preds:
+    node = new_preds.pop()
+    op_preds.add(node)
+
+    for pred in graph[node]['preds']:
+        new_preds.append(pred)
+
+  # Keep only the nodes that precede node node_id, without the
+  #  successors that are not in the subgraph.
+  subgraph = {n: graph[n] for n in graph if n in op_preds}
+  drop_missing(subgraph, 'succs', subgraph)
+
+  return subgraph
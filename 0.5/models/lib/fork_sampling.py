@@ -0,0 +1,55 @@
+# -----------------------------------------------------------------
+# Fork sampling
+# -----------------------------------------------------------------
+import math
+import numpy
+
+# Comparisons of the cmp nodes, on arrays of values.
+COMPARISONS = {'LT':    numpy.less,
+               'LTE':   numpy.less_equal,
+               'EQ':    numpy.equal,
+               'NEQ':   numpy.not_equal,
+               'GT':    numpy.greater,
+               'GTE':   numpy.greater_equal,
+               'TRUE':  lambda lhs, rhs: numpy.ones(len(lhs), dtype=bool),
+               'FALSE': lambda lhs, rhs: numpy.zeros(len(lhs), dtype=bool)}
+
+# decide_fork(c_matrix, lhs, rhs, op, vars, strict, points, confidence[, batch])
+#
+# Decides the direction of a fork in a subdomain by Monte Carlo: the
+#  expansions of both sides of the comparison are evaluated with the
+#  base of c_matrix at uniform random points in [-1,1] for the given
+#  variables, in batches of the given size, up to the given number of
+#  points. Returns True or False if the comparison gave that result at
+#  all the points, and None if it did not, which is known as soon as
+#  both results are seen.
+#
+# If strict is set, the direction taken at most of the points is
+#  returned instead. Sampling stops as soon as the Hoeffding bound for
+#  the given confidence tells which one it is.
+#
+def decide_fork(c_matrix, lhs, rhs, op, vars, strict, points, confidence, batch=64):
+  columns = [c_matrix.vars.index(v) for v in vars]
+  margin  = math.log(2.0 / (1.0 - confidence)) / 2.0
+  compare = COMPARISONS[op]
+  random_state = numpy.random.RandomState()
+
+  taken = 0
+  total = 0
+  while total < points:
+    size = min(batch, points - total)
+    sample = numpy.zeros((size, len(c_matrix.vars)))
+    sample[:, columns] = random_state.uniform(-1.0, 1.0, (size, len(columns)))
+    taken += int(numpy.count_nonzero(compare(c_matrix.evaluate_expansion(lhs, sample),
+                                             c_matrix.evaluate_expansion(rhs, sample))))
+    total += size
+
+    if strict:
+      if abs(float(taken) / total - 0.5) > math.sqrt(margin / total):
+        break
+    elif 0 < taken < total:
+      return None
+
+  if strict:
+    return 2*taken >= total
+  return taken == total
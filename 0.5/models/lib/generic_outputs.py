@@ -0,0 +1,98 @@
+# -----------------------------------------------------------------
+# Generic outputs
+# -----------------------------------------------------------------
+import numpy
+import sympy
+from scipy import sparse
+
+# -----------------------------------------------------------------
+# Compiled form of the outputs of an execution path propagated for a
+#  generic domain, where the coefficients of the inputs are symbols.
+#  Each coefficient of the outputs is a polynomial on those symbols,
+#  whose coefficients can also depend on other variables (such as the
+#  word-lengths of the noises):
+#
+#     sum_k (sum_m a_km * x^e_m) * b_k
+#
+#  The monomials x^e_m are stored as a matrix of exponents E, one row
+#  per monomial, the numbers a_km as a sparse matrix A and the factors
+#  b_k as sympy expressions, 1 for the numeric part. For a domain with
+#  coefficients x, all the sums come from a single product A x^E, and
+#  the outputs are rebuilt from them, with no sympy substitution.
+#
+# Coefficients that are not polynomials on the symbols are replaced
+#  with subs() instead.
+#
+class generic_outputs:
+  def __init__(self, outputs, generic_domain):
+    self.keys    = [(v, t) for v in generic_domain for t in generic_domain[v]]
+    self.symbols = [generic_domain[v][t] for (v, t) in self.keys]
+    self.outputs = {o: {} for o in outputs}
+
+    position  = {self.symbols[n]: n for n in range(len(self.symbols))}
+    monomials = {}
+    factors   = []
+    rows, columns, values = [], [], []
+    for o in outputs:
+      for term in outputs[o]:
+        sums = _extract_sums(sympy.expand(sympy.S(outputs[o][term])), position)
+        if sums is None:
+          self.outputs[o][term] = outputs[o][term]
+          continue
+        parts = []
+        for factor in sums:
+          for exponents, coefficient in sums[factor].iteritems():
+            rows.append(len(factors))
+            columns.append(monomials.setdefault(exponents, len(monomials)))
+            values.append(coefficient)
+          parts.append((len(factors), factor))
+          factors.append(factor)
+        self.outputs[o][term] = parts
+
+    keys = sorted(monomials, key=monomials.get)
+    self.exponents = numpy.array(keys, dtype=numpy.float64).reshape(len(keys), len(self.symbols))
+    self.matrix    = sparse.csr_matrix((values, (rows, columns)), shape=(len(factors), len(keys)))
+
+  # Returns the outputs for a domain with the same variables and terms
+  #  as the generic one. Missing terms are taken as zero. The numeric
+  #  coefficients are returned as floats.
+  def evaluate(self, domain):
+    x = numpy.array([domain[v].get(t, 0.0) for (v, t) in self.keys], dtype=numpy.float64)
+    sums = self.matrix.dot(numpy.prod(x ** self.exponents, axis=1))
+
+    zipped = None
+    result = {o: {} for o in self.outputs}
+    for o in self.outputs:
+      for term, parts in self.outputs[o].iteritems():
+        if not isinstance(parts, list):
+          if zipped is None:
+            zipped = [(self.symbols[n], x[n]) for n in range(len(self.symbols))]
+          result[o][term] = parts.subs(zipped)
+        elif all([factor == 1 for (row, factor) in parts]):
+          result[o][term] = float(sum([sums[row] for (row, factor) in parts]))
+        else:
+          result[o][term] = sympy.Add(*[float(sums[row])*factor for (row, factor) in parts])
+    return result
+
+# Splits an expanded expression in a dict that maps each factor that
+#  does not depend on the symbols to a dict of {exponents: number},
+#  or returns None if any of its terms is not a monomial on the
+#  symbols.
+def _extract_sums(expression, position):
+  sums = {}
+  for term in sympy.Add.make_args(expression):
+    independent, dependent = term.as_independent(*position.keys(), as_Add=False)
+    number, factor = independent.as_coeff_Mul()
+    if number == 0:
+      continue
+    exponents = [0] * len(position)
+    for symbol, power in dependent.as_powers_dict().iteritems():
+      if symbol == 1:
+        continue
+      if not symbol in position or not power.is_Integer or power < 0:
+        return None
+      exponents[position[symbol]] += int(power)
+    exponents = tuple(exponents)
+    factor_sums = sums.setdefault(factor, {})
+    factor_sums[exponents] = factor_sums.get(exponents, 0.0) + float(number)
+  return sums
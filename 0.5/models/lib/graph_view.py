@@ -0,0 +1,95 @@
+# -----------------------------------------------------------------
+# Graph views
+# -----------------------------------------------------------------
+import collections
+
+# The graphs derived from the system graph (execution paths, graphs
+#  with noises, cmp trees) share its nodes and BBs instead of copying
+#  them. For that to work, the nodes and BBs are never modified in
+#  place: whenever one of them changes, it is replaced by an updated
+#  copy (see update()), which only the derived graph sees.
+
+# overlay
+#
+# Dict of nodes (or BBs) layered over a base dict, which is never
+#  modified. The entries set or deleted in the overlay are kept apart
+#  from the base, and the rest are read from it. Iteration follows the
+#  order of the base, with the new entries at the end.
+#
+class overlay(collections.MutableMapping):
+
+  def __init__(self, base):
+    if isinstance(base, overlay):
+      # Overlays of overlays share the base of the first one, so the
+      #  lookups never go more than one level down.
+      self.base    = base.base
+      self.local   = dict(base.local)
+      self.removed = set(base.removed)
+    else:
+      self.base    = base
+      self.local   = {}
+      self.removed = set()
+
+  def __getitem__(self, key):
+    if key in self.local:
+      return self.local[key]
+    if key in self.removed:
+      raise KeyError(key)
+    return self.base[key]
+
+  def __setitem__(self, key, value):
+    self.local[key] = value
+    self.removed.discard(key)
+
+  def __delitem__(self, key):
+    if not key in self:
+      raise KeyError(key)
+    self.local.pop(key, None)
+    if key in self.base:
+      self.removed.add(key)
+
+  def __contains__(self, key):
+    return key in self.local or (key in self.base and not key in self.removed)
+
+  def __iter__(self):
+    for key in self.base:
+      if not key in self.removed:
+        yield key
+    for key in self.local:
+      if not key in self.base:
+        yield key
+
+  def __len__(self):
+    return len(self.base) - len(self.removed) + len([x for x in self.local if not x in self.base])
+
+  def __repr__(self):
+    return repr(dict(self.iteritems()))
+
+# derive(graph)
+#
+# Returns a graph whose nodes and BBs are overlays over the ones of the
+#  given graph. The lists of inputs and outputs are copied. The
+#  execution plan of the graph, if any, is not kept, as the nodes of
+#  the derived graph are meant to change.
+#
+def derive(graph):
+  derived = dict(graph)
+  derived.pop('plan', None)
+  for key in ['nodes', 'bbs']:
+    if key in graph:
+      derived[key] = overlay(graph[key])
+  for key in ['inputs', 'outputs']:
+    if key in graph:
+      derived[key] = list(graph[key])
+  return derived
+
+# update(entries, key, **fields)
+#
+# Replaces the entry (node or BB) with a copy with the given fields
+#  changed, leaving the original one untouched. Returns the new entry.
+#
+def update(entries, key, **fields):
+  entry = dict(entries[key])
+  entry.update(fields)
+  entries[key] = entry
+  return entry
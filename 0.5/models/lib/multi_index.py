@@ -0,0 +1,89 @@
+# -----------------------------------------------------------------
+# Multi-indices
+# -----------------------------------------------------------------
+from math import factorial
+
+# Memoized orders and ranks, keyed by (dim, order).
+_orders = {}
+_ranks  = {}
+
+# graded(dim, order)
+#
+# Generates the multi-indices of the given dimension with a total
+#  degree up to the given order, by increasing total degree and, for
+#  the same degree, in lexicographic order. That is the order of the
+#  terms in the PCE bases, as if the tuples of itertools.product were
+#  filtered by their sum, but only the valid ones are visited.
+#
+def graded(dim, order):
+  for degree in range(order + 1):
+    for multi_index in _compositions(degree, dim):
+      yield multi_index
+
+# Generates the tuples of dim non-negative integers that add up to
+#  degree, in lexicographic order.
+def _compositions(degree, dim):
+  if dim == 0:
+    if degree == 0:
+      yield ()
+    return
+  if dim == 1:
+    yield (degree,)
+    return
+  for first in range(degree + 1):
+    for rest in _compositions(degree - first, dim - 1):
+      yield (first,) + rest
+
+# count(dim, order)
+#
+# Returns the number of multi-indices up to the given order, which
+#  is the size of the base.
+#
+def count(dim, order):
+  return factorial(dim + order) / (factorial(dim) * factorial(order))
+
+# get_orders(dim, order)
+#
+# Returns the list of graded multi-indices, which maps positions in
+#  the base to multi-indices (unrank). It is computed only once for
+#  each dimension and order, so it must not be modified.
+#
+def get_orders(dim, order):
+  key = (dim, order)
+  if not key in _orders:
+    _orders[key] = list(graded(dim, order))
+  return _orders[key]
+
+# get_ranks(dim, order)
+#
+# Returns the dict that maps the multi-indices to their position in
+#  the base (rank). It is computed only once for each dimension and
+#  order, so it must not be modified.
+#
+def get_ranks(dim, order):
+  key = (dim, order)
+  if not key in _ranks:
+    orders = get_orders(dim, order)
+    _ranks[key] = {orders[n]: n for n in range(len(orders))}
+  return _ranks[key]
+
+# get_products(a, b, order)
+#
+# Generates, in lexicographic order, the multi-indices c with a total
+#  degree up to order whose polynomials can have a non-zero expected
+#  product with the ones of a and b. In every dimension the orders
+#  must satisfy the triangle inequality, |a_d - b_d| <= c_d <= a_d + b_d,
+#  and add up to an even number. Their positions in the base are given
+#  by get_ranks(), so the non-zero elements of a row of the C matrix
+#  are found without going over the whole base.
+#
+def get_products(a, b, order):
+  return _products(a, b, 0, order)
+
+def _products(a, b, d, budget):
+  if d == len(a):
+    yield ()
+    return
+  for c in range(abs(a[d] - b[d]), min(a[d] + b[d], budget) + 1, 2):
+    for rest in _products(a, b, d + 1, budget - c):
+      yield (c,) + rest
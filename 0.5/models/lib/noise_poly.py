@@ -0,0 +1,124 @@
+# -----------------------------------------------------------------
+# Noise polynomials
+# -----------------------------------------------------------------
+import numpy
+import sympy
+
+# -----------------------------------------------------------------
+# Compiled form of an expression on the word-length variables, such
+#  as the aggregated noise mean or variance of an output. Those
+#  expressions are sums of terms c * 2**(e_1*wl_1 + ... + e_n*wl_n),
+#  so they are stored as a vector of coefficients c and a matrix of
+#  exponents E with one row per term, and evaluated for a batch of
+#  word-length vectors W as exp2(W E^T) c.
+#
+# Expressions that do not follow that structure are evaluated with
+#  a lambdified NumPy function instead.
+#
+class noise_poly:
+  def __init__(self, expression, wlvars):
+    self.wlvars = list(wlvars)
+    self.function = None
+
+    terms = _extract_terms(sympy.expand(sympy.S(expression)), self.wlvars)
+    if terms is None:
+      self.exponents    = None
+      self.coefficients = None
+      self.function     = sympy.lambdify(self.wlvars, expression, 'numpy')
+    else:
+      # Terms with the same exponents are added together.
+      merged = {}
+      for exponents, coefficient in terms:
+        merged[exponents] = merged.get(exponents, 0.0) + coefficient
+      keys = sorted(merged.keys())
+      self.exponents    = numpy.array(keys, dtype=numpy.float64).reshape(len(keys), len(self.wlvars))
+      self.coefficients = numpy.array([merged[k] for k in keys], dtype=numpy.float64)
+
+      # Terms that depend on each word-length variable.
+      self.columns = [numpy.nonzero(self.exponents[:, n])[0] for n in range(len(self.wlvars))]
+
+    # Word-length vector and term values of the last delta() call.
+    self.reference = (None, None)
+
+  # Evaluates the expression for a word-length vector, returning a
+  #  float, or for a 2-D batch of them (one per row), returning a
+  #  vector with one value per row.
+  def evaluate(self, wlvs):
+    wlvs = numpy.asarray(wlvs, dtype=numpy.float64)
+    batch = wlvs.reshape(-1, len(self.wlvars))
+
+    if self.function is None:
+      values = numpy.exp2(batch.dot(self.exponents.T)).dot(self.coefficients)
+    else:
+      values = numpy.asarray(self.function(*batch.T), dtype=numpy.float64) * numpy.ones(len(batch))
+
+    if wlvs.ndim < 2:
+      return float(values[0])
+    return values
+
+  # Computes the change of the expression when the word-length of the
+  #  given index of the vector is set to new_wl. Only the terms that
+  #  depend on it are updated, and the term values of the vector are
+  #  kept for the following calls with the same vector.
+  def delta(self, wlv, index, new_wl):
+    if not self.function is None:
+      moved = list(wlv)
+      moved[index] = new_wl
+      return self.evaluate(moved) - self.evaluate(wlv)
+
+    key, values = self.reference
+    if key != tuple(wlv):
+      key = tuple(wlv)
+      values = self.coefficients * numpy.exp2(self.exponents.dot(numpy.asarray(wlv, dtype=numpy.float64)))
+      self.reference = (key, values)
+
+    terms = self.columns[index]
+    change = numpy.exp2(self.exponents[terms, index] * (new_wl - wlv[index])) - 1.0
+    return float(values[terms].dot(change))
+
+  def __call__(self, wlvs):
+    return self.evaluate(wlvs)
+
+# Splits an expanded expression in a list of (exponents, coefficient)
+#  tuples, or returns None if any of its terms is not of the form
+#  c * 2**(linear combination of the word-length variables).
+def _extract_terms(expression, wlvars):
+  position = {wlvars[n]: n for n in range(len(wlvars))}
+  terms = []
+  for term in sympy.Add.make_args(expression):
+    coefficient = 1.0
+    exponents   = [0.0] * len(wlvars)
+    for factor in sympy.Mul.make_args(term):
+      if factor.is_Number:
+        coefficient *= float(factor)
+      elif factor.is_Pow and factor.base == 2:
+        constant, linear = factor.exp.as_coeff_Add()
+        coefficient *= 2.0**float(constant)
+        for part in sympy.Add.make_args(linear):
+          weight, symbol = part.as_coeff_Mul()
+          if not symbol in position:
+            return None
+          exponents[position[symbol]] += float(weight)
+      else:
+        return None
+    if coefficient != 0.0:
+      terms.append((tuple(exponents), coefficient))
+  return terms
+
+# add_terms(terms, expression, weight=1.0)
+#
+# Adds an expression on the word-length variables, multiplied by the
+#  weight, to a dict of coefficients keyed by the monomials of the
+#  expression. It keeps aggregated expressions compact no matter how
+#  many of them are added.
+#
+def add_terms(terms, expression, weight=1.0):
+  for monomial, coefficient in sympy.expand(sympy.S(expression)).as_coefficients_dict().iteritems():
+    terms[monomial] = terms.get(monomial, 0.0) + float(coefficient)*weight
+
+# to_expression(terms)
+#
+# Builds the expression represented by a dict of terms.
+#
+def to_expression(terms):
+  return sympy.Add(*[coefficient*monomial for monomial, coefficient in terms.iteritems() if coefficient != 0.0])
@@ -0,0 +1,91 @@
+# -----------------------------------------------------------------
+# Orthogonal polynomials
+# -----------------------------------------------------------------
+import numpy
+import sympy
+from fractions import Fraction
+
+# The 1.0 tree has a copy of this module with the same API in
+#  1.0/lib/orthopoly.py, as the two trees do not share any module.
+
+# Memoized coefficient tables, keyed by (family, order), and symbolic
+#  polynomials, keyed by (family, order, variable).
+_coefficients = {}
+_polynomials  = {}
+
+# legendre_coefficients(order)
+#
+# Computes the coefficients of the Legendre polynomials up to the
+#  given order with the recurrence
+#
+#     (n+1)*P_{n+1}(x) = (2n+1)*x*P_n(x) - n*P_{n-1}(x)
+#
+#  using exact fractions. Returns a list with the coefficients of each
+#  polynomial, in increasing powers of x.
+#
+def legendre_coefficients(order):
+  coeffs = [[Fraction(1)], [Fraction(0), Fraction(1)]]
+  for n in range(1, order):
+    shifted = [Fraction(0)] + coeffs[n]
+    previous = coeffs[n-1] + [Fraction(0), Fraction(0)]
+    coeffs.append([((2*n + 1)*shifted[p] - n*previous[p]) / (n + 1) for p in range(n + 2)])
+  return coeffs[:order+1]
+
+# legendre_values(order, x)
+#
+# Evaluates the Legendre polynomials up to the given order on an array
+#  of numeric values, running the same recurrence on the values. That
+#  avoids the powers of x and the cancellations between the large
+#  coefficients of the high orders. Returns an array with one row per
+#  polynomial.
+#
+def legendre_values(order, x):
+  values = numpy.empty((order + 1,) + x.shape)
+  values[0] = 1.0
+  if order > 0:
+    values[1] = x
+  for n in range(1, order):
+    values[n+1] = ((2*n + 1)*x*values[n] - n*values[n-1]) / (n + 1)
+  return values
+
+# Families of polynomials, by the name used to key the C matrices, and
+#  their numeric evaluation.
+FAMILIES   = {'legendre': legendre_coefficients}
+EVALUATORS = {'legendre': legendre_values}
+
+# get_coefficients(family, order)
+#
+# Returns a NumPy array with one row per polynomial up to the given
+#  order and one column per power of the variable, for numeric
+#  evaluation. It is memoized, so it must not be modified.
+#
+def get_coefficients(family, order):
+  key = (family, order)
+  if not key in _coefficients:
+    table = numpy.zeros((order + 1, order + 1))
+    for n, coeffs in enumerate(FAMILIES[family](order)):
+      table[n, :len(coeffs)] = [float(c) for c in coeffs]
+    _coefficients[key] = table
+  return _coefficients[key]
+
+# get_polynomials(family, order, var)
+#
+# Returns the list of polynomials up to the given order on the given
+#  sympy variable. It is memoized, so it must not be modified.
+#
+def get_polynomials(family, order, var):
+  key = (family, order, var)
+  if not key in _polynomials:
+    table = get_coefficients(family, order)
+    pows = [sympy.S(1.0)] + [var**p for p in range(1, order + 1)]
+    _polynomials[key] = [sum([pows[p]*sympy.S(float(table[n, p])) for p in range(n + 1)]) for n in range(order + 1)]
+  return _polynomials[key]
+
+# evaluate(family, order, x)
+#
+# Evaluates the polynomials up to the given order on an array of
+#  numeric values, by recurrence. Returns an array with one row per
+#  polynomial.
+#
+def evaluate(family, order, x):
+  return EVALUATORS[family](order, numpy.asarray(x, dtype=numpy.float64))
@@ -1,6 +1,7 @@
 # -----------------------------------------------------------------
 # PCE operations
 # -----------------------------------------------------------------
+import numpy
 from collections import Counter
 # -----------------------------------------------------------------
 # Propagate two PCE polynomials through an ADD operator
@@ -27,7 +28,14 @@ def sub(a, b):
 # -----------------------------------------------------------------
 # Propagate two PCE polynomials through an MUL operator
 #
+# Numeric polynomials are multiplied as dense coefficient vectors
+#  against the sparse C matrix. Polynomials with symbolic (e.g.
+#  word-length dependent) coefficients go through the generic path.
+#
 def mul(a, b, c_matrix):
+  if is_numeric(a) and is_numeric(b):
+    return mul_numeric(a, b, c_matrix)
+
   c = {}
   tuples = [(i, j, k)
         for i in a.keys()
@@ -35,8 +43,37 @@ def mul(a, b, c_matrix):
         for k in c_matrix.base]
   for t in tuples:
     c.update({t[2]: c.get(t[2], 0.0) + (a[t[0]]*b[t[1]]*c_matrix.matrix.get(t,0.0))})
-  for k in c.keys(): # Allow some rounding so the system is not too overloaded. 
+  for k in c.keys(): # Allow some rounding so the system is not too overloaded.
     if c[k] is float:
       if c[k] <= 1e-13: c[k] = 0.0
 
-  return {k: v for k, v in c.iteritems() if v != 0.0}
\ No newline at end of file
+  return {k: v for k, v in c.iteritems() if v != 0.0}
+
+# -----------------------------------------------------------------
+# Propagate two numeric PCE polynomials through an MUL operator
+#
+def mul_numeric(a, b, c_matrix):
+  c = c_matrix.matrix.contract(to_vector(a, c_matrix), to_vector(b, c_matrix))
+  return {c_matrix.base[k]: float(c[k]) for k in numpy.flatnonzero(c)}
+
+# -----------------------------------------------------------------
+# Check that all the coefficients of a PCE polynomial are numbers
+#
+def is_numeric(a):
+  for v in a.itervalues():
+    if not isinstance(v, (int, long, float, numpy.number)) and not getattr(v, 'is_Number', False):
+      return False
+  return True
+
+# -----------------------------------------------------------------
+# Convert a PCE polynomial in a dense vector of coefficients over
+#  the base of the C matrix. Terms outside the base are dropped,
+#  since they have no entries in the C matrix anyway.
+#
+def to_vector(a, c_matrix):
+  vector = numpy.zeros(len(c_matrix.base))
+  for k, v in a.iteritems():
+    index = c_matrix.index.get(k, None)
+    if not index is None:
+      vector[index] += float(v)
+  return vector
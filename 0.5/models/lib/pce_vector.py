@@ -0,0 +1,108 @@
+# -----------------------------------------------------------------
+# PCE coefficient vectors
+# -----------------------------------------------------------------
+import numpy
+
+# -----------------------------------------------------------------
+# A PCE polynomial stored as a dense float64 vector of coefficients
+#  aligned to the base of a C matrix. Symbolic coefficients (e.g.
+#  those of the noise sources, which depend on the word-lengths) are
+#  kept aside in a dict keyed by the position in the base, and they
+#  are added to the numeric coefficient in the same position. Terms
+#  that are not part of the base are carried over by ADD and SUB,
+#  but they have no entries in the C matrix, so MUL drops them.
+#
+class PCEVector:
+  def __init__(self, c_matrix, coeffs=None, symbolic=None, extra=None):
+    self.c_matrix = c_matrix
+    self.coeffs   = numpy.zeros(len(c_matrix.base)) if coeffs is None else coeffs
+    self.symbolic = {} if symbolic is None else symbolic
+    self.extra    = {} if extra is None else extra
+
+  def add(self, other):
+    return PCEVector(self.c_matrix, self.coeffs + other.coeffs,
+                     _merge(self.symbolic, other.symbolic, 1),
+                     _merge(self.extra, other.extra, 1))
+
+  def sub(self, other):
+    return PCEVector(self.c_matrix, self.coeffs - other.coeffs,
+                     _merge(self.symbolic, other.symbolic, -1),
+                     _merge(self.extra, other.extra, -1))
+
+  def mul(self, other):
+    matrix = self.c_matrix.matrix
+    coeffs = matrix.contract(self.coeffs, other.coeffs)
+
+    # Cross products with the symbolic coefficients. There are only a few
+    #  of them, so each one is handled on its own.
+    symbolic = {}
+    for j, value in other.symbolic.iteritems():
+      unit = numpy.zeros(len(coeffs))
+      unit[j] = 1.0
+      _accumulate(symbolic, matrix.contract(self.coeffs, unit), value)
+    for i, value in self.symbolic.iteritems():
+      unit = numpy.zeros(len(coeffs))
+      unit[i] = 1.0
+      _accumulate(symbolic, matrix.contract(unit, other.coeffs), value)
+      row_j, row_k, row_values = matrix.row(i)
+      for j, other_value in other.symbolic.iteritems():
+        selected = row_j == j
+        for k, c in zip(row_k[selected], row_values[selected]):
+          symbolic[int(k)] = symbolic.get(int(k), 0.0) + value*other_value*float(c)
+
+    return PCEVector(self.c_matrix, coeffs, {k: v for k, v in symbolic.iteritems() if v != 0.0})
+
+  def __add__(self, other):
+    return self.add(other)
+
+  def __sub__(self, other):
+    return self.sub(other)
+
+  def __mul__(self, other):
+    return self.mul(other)
+
+  # Returns the polynomial as a dict keyed by base expressions.
+  def to_dict(self):
+    base = self.c_matrix.base
+    result = {base[k]: float(self.coeffs[k]) for k in numpy.flatnonzero(self.coeffs)}
+    for k, value in self.symbolic.iteritems():
+      result[base[k]] = result[base[k]] + value if base[k] in result else value
+    result.update(self.extra)
+    return {k: v for k, v in result.iteritems() if v != 0.0}
+
+# from_dict(a, c_matrix)
+#
+# Builds the vector form of a PCE polynomial stored as a dict keyed
+#  by base expressions.
+#
+def from_dict(a, c_matrix):
+  vector = PCEVector(c_matrix)
+  for term, value in a.iteritems():
+    index = c_matrix.index.get(term, None)
+    if index is None:
+      vector.extra[term] = vector.extra.get(term, 0.0) + value
+    elif isinstance(value, (int, long, float, numpy.number)) or getattr(value, 'is_Number', False):
+      vector.coeffs[index] += float(value)
+    else:
+      vector.symbolic[index] = vector.symbolic.get(index, 0.0) + value
+  return vector
+
+# constant(value, c_matrix)
+#
+# Builds the vector form of a constant value.
+#
+def constant(value, c_matrix):
+  vector = PCEVector(c_matrix)
+  # The first term of the base is always the constant one.
+  vector.coeffs[0] = value
+  return vector
+
+def _merge(a, b, sign):
+  result = dict(a)
+  for k, v in b.iteritems():
+    result[k] = result.get(k, 0.0) + sign*v
+  return {k: v for k, v in result.iteritems() if v != 0.0}
+
+def _accumulate(symbolic, weights, value):
+  for k in numpy.flatnonzero(weights):
+    symbolic[int(k)] = symbolic.get(int(k), 0.0) + value*float(weights[k])
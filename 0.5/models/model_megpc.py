@@ -7,6 +7,7 @@ import sys
 import copy
 import time
 import random
+import numpy
 import scipy
 import sympy
 import pickle
@@ -21,6 +22,11 @@ sys.path.insert(0,parentdir)
 import hoplite_utils
 from lib import c_matrix
 from lib import pce_ops
+from lib import pce_vector
+from lib import noise_poly
+from lib import exec_paths
+from lib import graph_view
+from lib import fork_sampling
 
 from itertools import product
 
@@ -31,6 +37,8 @@ class model_megpc:
     self.order          = config['megpc_order']
     self.partition_size = config['megpc_partition_size']
     self.j_lim          = config['megpc_j_lim']
+    self.mc_points      = config.get('megpc_mc_points', 1000)
+    self.mc_confidence  = config.get('megpc_mc_confidence', 0.99)
     self.theta_1        = config['megpc_theta_1']
     self.theta_2        = config['megpc_theta_2']
     self.alpha          = config['megpc_alpha']
@@ -42,7 +50,9 @@ class model_megpc:
     self.input_to_rvars = {source['inputs'][i]: self.input_rvars[i] for i in range(len(self.signal_inputs))}
     self.input_dists    = source_config.get('distributions', {x: {1.0*x: 1.0} for x in self.input_rvars})
 
-    self.clean_c_matrix = c_matrix.c_matrix(self.input_rvars, self.order)
+    self.c_matrix_workers = config.get('c_matrix_workers', None)
+    self.c_matrix_lazy    = config.get('c_matrix_lazy', False)
+    self.clean_c_matrix = c_matrix.c_matrix(self.input_rvars, self.order, self.c_matrix_workers)
 
     self.noised_expectances = {}
 
@@ -66,32 +76,38 @@ class model_megpc:
     self.num_noises = 0
     self.outputs = source['outputs']
 
-    self.solution_files = {}
+    self.aggregate = None
 
     self.dump_files = os.path.join(destination, 'dump_files')
     if not os.path.exists(self.dump_files): os.makedirs(self.dump_files)
 
   def compute(self):
+    aggregate_file = os.path.join(self.dump_files, 'noise_aggregate')
     backup_files = [os.path.join(self.dump_files, x) for x in os.listdir(self.dump_files) if x.startswith('solution_')]
 
-    if backup_files:
+    if os.path.exists(aggregate_file):
+      print 'Found aggregated results, skipping processing.'
+      with open(aggregate_file, 'rb') as agg:
+        noise_bundle = pickle.load(agg)
+        self.restore_noise_bundle(noise_bundle)
+        self.aggregate = noise_bundle['aggregate']
+    elif backup_files:
+      # Solution files dumped by older versions are reduced only once.
       print 'Found backup files, skipping processing.'
-      self.solution_files = {x: backup_files[x] for x in range(len(backup_files))}
       with open(os.path.join(self.dump_files, 'noise_info'), 'r') as noin:
-        noise_bundle = pickle.load(noin)
-        self.noised_expectances = noise_bundle['expectances']
-        self.noise_inputs       = noise_bundle['inputs']
-        self.noise_rvars        = noise_bundle['rvars']
-        self.noise_wlvars       = noise_bundle['wlvars']
-        self.noise_dists        = noise_bundle['dists']
-        self.noise_equivs       = noise_bundle['equivs']
-        self.num_noises         = noise_bundle['num']
+        self.restore_noise_bundle(pickle.load(noin))
+      self.aggregate = self.new_aggregate()
+      for backup_file in backup_files:
+        with open(backup_file, 'r') as sol:
+          self.reduce_solution(pickle.load(sol))
+      self.save_aggregate(aggregate_file)
     else:
       execution_paths = self.get_execution_paths()
       with open(os.path.join(self.dump_files, 'execution_paths'), 'w') as exe:
         pickle.dump(execution_paths, exe)
 
       self.noised_results = []
+      self.aggregate = self.new_aggregate()
       if len(execution_paths) == 1:
         domain = {'coeffs': self.input_dists,
                   'domain': {self.input_to_rvars[x]: (-1.0, 1.0) for x in execution_paths[0]['path']['inputs']},
@@ -100,22 +116,7 @@ class model_megpc:
         domain_solutions = self.apply_model(execution_paths[0], domain)
 
         for solution in domain_solutions:
-          pickle_file = os.path.join(self.dump_files, 'solution_0')
-          with open(pickle_file, 'w') as sol:
-            pickle.dump(solution, sol)
-            print pickle_file
-            self.solution_files.update({(0,): pickle_file})
-        noise_bundle = {
-          'expectances': self.noised_expectances,
-          'inputs':      self.noise_inputs,
-          'rvars':       self.noise_rvars,
-          'wlvars':      self.noise_wlvars,
-          'dists':       self.noise_dists,
-          'equivs':      self.noise_equivs,
-          'num':         self.num_noises,
-        }
-        with open(os.path.join(self.dump_files, 'noise_info'), 'w') as noin:
-          pickle.dump(noise_bundle, noin)
+          self.reduce_solution(solution)
       else:
         # subdomains_by_decisions will retain all the information on which
         #  subdomain corresponds to which chain of decisions. It will store
@@ -142,56 +143,30 @@ class model_megpc:
           subdomains_by_decisions = self.partition_conditional(path, subdomains_by_decisions)
 
           # Step 2: Take the list of subdomains for the current decision and propagate
-          #  the coefficients as a regular PCE.
+          #  the coefficients as a regular PCE. Each solution is reduced into the
+          #  aggregated results as soon as it is available.
           j = 1
           len_subdomains = len(subdomains_by_decisions[tuple(path['decisions'].keys())][tuple(path['decisions'].values())])
           for domain in subdomains_by_decisions[tuple(path['decisions'].keys())][tuple(path['decisions'].values())]:
             print "Propagating values for subdomain %d out of %d" % (j, len_subdomains)
             domain_solutions = self.apply_model(path, domain)
-            k = 1
             for solution in domain_solutions:
-              pickle_file = os.path.join(self.dump_files, 'solution_{}_{}_{}'.format(str(i), str(j), str(k)))
-              with open(pickle_file, 'w') as sol:
-                pickle.dump(solution, sol)
-                self.solution_files.update({(i,j, k): pickle_file})
-              k += 1
-
-            noise_bundle = {
-              'expectances': self.noised_expectances,
-              'inputs':      self.noise_inputs,
-              'rvars':       self.noise_rvars,
-              'wlvars':      self.noise_wlvars,
-              'dists':       self.noise_dists,
-              'equivs':      self.noise_equivs,
-              'num':         self.num_noises,
-            }
-            with open(os.path.join(self.dump_files, 'noise_info'), 'w') as noin:
-              pickle.dump(noise_bundle, noin)
-
-
+              self.reduce_solution(solution)
             j += 1
           i += 1
 
-    # Step 3: Compute results
-    output_sum_clean_mean     = {o: sympy.S(0.0) for o in self.original_source['outputs']}
-    output_sum_clean_variance = {o: sympy.S(0.0) for o in self.original_source['outputs']}
-    output_sum_noised_mean    = {o: sympy.S(0.0) for o in self.original_source['outputs']}
-  
-    for s in self.solution_files:
-      with open(self.solution_files[s], 'r') as sol:
-        sol_info = pickle.load(sol)
-        for o in self.original_source['outputs']:
-          output_sum_clean_mean[o]     += sol_info['clean_outputs'][o].get(sympy.S(1.0), 0.0)*sol_info['j_k']
-          output_sum_clean_variance[o] += sum([(sol_info['clean_outputs'][o][x]**2)*sol_info['j_k']*self.clean_c_matrix.expectances[x] for x in sol_info['clean_outputs'][o]])
-          output_sum_noised_mean[o]    += sol_info['noised_outputs'][o].get(sympy.S(1.0), 0.0)*sol_info['j_k']
+      self.save_aggregate(aggregate_file)
 
+    # Step 3: Compute results
     print 'Calculating means and clean variance.'
 
-    self.clean_mean     = [output_sum_clean_mean[x] for x in self.original_source['outputs']]
-    self.clean_variance = [output_sum_clean_variance[x] for x in self.original_source['outputs']]
-    self.noise_mean     = [output_sum_noised_mean[x] for x in self.original_source['outputs']]
+    self.clean_mean     = [self.aggregate['clean_mean'][x] for x in self.original_source['outputs']]
+    self.clean_variance = [self.aggregate['clean_variance'][x] for x in self.original_source['outputs']]
+    self.noise_mean     = [noise_poly.to_expression(self.aggregate['noise_mean'][x]) for x in self.original_source['outputs']]
+    self.noise_variance = [noise_poly.to_expression(self.aggregate['noise_variance'][x]) for x in self.original_source['outputs']]
 
     self.num_noises = len(self.noise_wlvars)
+    self.compile_noise_polys()
     self.computed = True
 
   # get_noise_mean(output, wlv)
@@ -206,9 +181,9 @@ class model_megpc:
     if not self.computed:
       sys.exit("System has not been computed")
     if output is None:
-      return [n.subs(zip(self.noise_wlvars, wlv)) for n in self.noise_mean]
+      return [n.evaluate(wlv) for n in self.noise_mean_polys]
     else:
-      return self.noise_mean[self.original_source['outputs'].index(output)].subs(zip(self.noise_wlvars, wlv))
+      return self.noise_mean_polys[self.original_source['outputs'].index(output)].evaluate(wlv)
 
   # get_noise_variance(output, wlv)
   #
@@ -218,65 +193,140 @@ class model_megpc:
   def get_noise_variance(self, wlv, output=None):
     if not self.computed:
       sys.exit("System has not been computed")
+    if output is None:
+      return [n.evaluate(wlv) for n in self.noise_variance_polys]
+    else:
+      return self.noise_variance_polys[self.original_source['outputs'].index(output)].evaluate(wlv)
 
-    print 'Requested noise variance for:'
-    print wlv
-
-    zipped = zip(self.noise_wlvars, wlv)
-
-    if not output is None:
-      output_sum_noise_variance = sympy.S(0.0)
-      for s in self.solution_files:
-        with open(self.solution_files[s], 'r') as sol:
-          sol_info = pickle.load(sol)
-
-          output_sum_noise_variance += sum([((sol_info['noised_outputs'][output][x]**2)*sol_info['j_k']*self.noised_expectances[x]).subs(zipped) for x in sol_info['noised_outputs'][output]])
+  # get_noise_variances(wlvs)
+  #
+  # Computes the noise variance values of all the output signals for
+  #  a batch of WordLength Vectors in a single call. Returns an array
+  #  with one row per WLV and one column per output.
+  #
+  def get_noise_variances(self, wlvs):
+    if not self.computed:
+      sys.exit("System has not been computed")
+    wlvs = numpy.asarray(wlvs, dtype=numpy.float64).reshape(-1, self.num_noises)
+    return numpy.column_stack([n.evaluate(wlvs) for n in self.noise_variance_polys])
 
-      print 'Gonna return {}'.format(str(output_sum_noise_variance))
-      return output_sum_noise_variance
+  # delta_variance(wlv, index, new_wl, output=None)
+  #
+  # Computes the change of the noise variance of the indicated output
+  #  signal (or of all of them) when the word-length of the given index
+  #  of the WordLength Vector is set to new_wl. Only the terms of the
+  #  noise variance that depend on that word-length are evaluated.
+  #
+  def delta_variance(self, wlv, index, new_wl, output=None):
+    if not self.computed:
+      sys.exit("System has not been computed")
+    if output is None:
+      return [n.delta(wlv, index, new_wl) for n in self.noise_variance_polys]
     else:
-      output_sum_noise_variance = {o: sympy.S(0.0) for o in self.original_source['outputs']}
+      return self.noise_variance_polys[self.original_source['outputs'].index(output)].delta(wlv, index, new_wl)
 
-      for s in self.solution_files:
-        with open(self.solution_files[s], 'r') as sol:
-          sol_info = pickle.load(sol)
-          for o in self.original_source['outputs']:
-            output_sum_noise_variance[o] += sum([((sol_info['noised_outputs'][o][x]**2)*sol_info['j_k']*self.noised_expectances[x]).subs(zipped) for x in sol_info['noised_outputs'][o]])
+  # compile_noise_polys()
+  #
+  # Compiles the aggregated noise mean and variance expressions of
+  #  the outputs into noise polynomials, so they are evaluated with
+  #  NumPy instead of substituting the WLV in the sympy expressions.
+  #
+  def compile_noise_polys(self):
+    self.noise_mean_polys     = [noise_poly.noise_poly(x, self.noise_wlvars) for x in self.noise_mean]
+    self.noise_variance_polys = [noise_poly.noise_poly(x, self.noise_wlvars) for x in self.noise_variance]
 
-      print 'Gonna return:'
-      print [output_sum_noise_variance[x] for x in self.original_source['outputs']]
-      return [output_sum_noise_variance[x] for x in self.original_source['outputs']]
+  # new_aggregate()
+  #
+  # Returns an empty set of aggregated results. Means and variances
+  #  are kept for each output; the noise ones as dicts of terms over
+  #  the word-length variables (see noise_poly.add_terms).
+  #
+  def new_aggregate(self):
+    return {'clean_mean':     {o: sympy.S(0.0) for o in self.original_source['outputs']},
+            'clean_variance': {o: sympy.S(0.0) for o in self.original_source['outputs']},
+            'noise_mean':     {o: {} for o in self.original_source['outputs']},
+            'noise_variance': {o: {} for o in self.original_source['outputs']}}
+
+  # reduce_solution(solution)
+  #
+  # Adds the contribution of the solution of an ME-gPC partition,
+  #  weighted by its j_k, to the aggregated results.
+  #
+  def reduce_solution(self, solution):
+    j_k = solution['j_k']
+    for o in self.original_source['outputs']:
+      clean_output  = solution['clean_outputs'][o]
+      noised_output = solution['noised_outputs'][o]
+      self.aggregate['clean_mean'][o]     += clean_output.get(sympy.S(1.0), 0.0)*j_k
+      self.aggregate['clean_variance'][o] += sum([(clean_output[x]**2)*j_k*self.clean_c_matrix.expectances[x] for x in clean_output])
+      noise_poly.add_terms(self.aggregate['noise_mean'][o], noised_output.get(sympy.S(1.0), 0.0), j_k)
+      for x in noised_output:
+        noise_poly.add_terms(self.aggregate['noise_variance'][o], noised_output[x]**2, j_k*self.noised_expectances[x])
+
+  # save_aggregate(aggregate_file)
+  #
+  # Stores the aggregated results, together with the information about
+  #  the noises needed to use them, in a single file.
+  #
+  def save_aggregate(self, aggregate_file):
+    noise_bundle = {
+      'expectances': self.noised_expectances,
+      'inputs':      self.noise_inputs,
+      'rvars':       self.noise_rvars,
+      'wlvars':      self.noise_wlvars,
+      'dists':       self.noise_dists,
+      'equivs':      self.noise_equivs,
+      'num':         self.num_noises,
+      'aggregate':   self.aggregate,
+    }
+    with open(aggregate_file + '.tmp', 'wb') as agg:
+      pickle.dump(noise_bundle, agg, pickle.HIGHEST_PROTOCOL)
+    os.rename(aggregate_file + '.tmp', aggregate_file)
+
+  # restore_noise_bundle(noise_bundle)
+  #
+  # Restores the information about the noises stored with the results.
+  #
+  def restore_noise_bundle(self, noise_bundle):
+    self.noised_expectances = noise_bundle['expectances']
+    self.noise_inputs       = noise_bundle['inputs']
+    self.noise_rvars        = noise_bundle['rvars']
+    self.noise_wlvars       = noise_bundle['wlvars']
+    self.noise_dists        = noise_bundle['dists']
+    self.noise_equivs       = noise_bundle['equivs']
+    self.num_noises         = noise_bundle['num']
 
   # -----------------------------------------------------------------
   # AUXILIAR FUNCTIONS
   # -----------------------------------------------------------------
 
-  # propagate(source, c_matrix)
+  # propagate(graph, dists, c_matrix)
   #
-  # Propagates the PCE coefficients through the system.
+  # Propagates the PCE coefficients through the system, following the
+  #  execution plan stored with the graph.
   #
-  def propagate(self, source, dists, c_matrix):
-    propagation = [None] * (max(source.keys()) + 1)
-
-    execution_order = hoplite_utils.get_execution_order(source)
-
-    for elem in execution_order:
-      if source[elem]['op'] == 'input':
-        propagation[elem] = dists[self.input_rvars[elem]]
-      if source[elem]['op'] == 'const':
-        propagation[elem] = {sympy.S(1.0):float(source[elem]['value'])}
-      if source[elem]['op'] == 'output':
-        propagation[elem] = propagation[source[elem]['preds'][0]]
-      if source[elem]['op'] == 'add':
-        propagation[elem] = pce_ops.add(propagation[source[elem]['preds'][0]], propagation[source[elem]['preds'][1]])
-      if source[elem]['op'] == 'sub':
-        propagation[elem] = pce_ops.sub(propagation[source[elem]['preds'][0]], propagation[source[elem]['preds'][1]])
-      if source[elem]['op'] == 'mul':
-        propagation[elem] = pce_ops.mul(propagation[source[elem]['preds'][0]], propagation[source[elem]['preds'][1]], c_matrix)
-      if source[elem]['op'] == 'noise':
-        propagation[elem] = pce_ops.add(propagation[source[elem]['preds'][0]], self.noise_dists[source[elem]['symbol']])
-
-    return propagation
+  def propagate(self, graph, dists, c_matrix):
+    nodes = graph['nodes']
+    plan = graph['plan']
+    propagation = [None] * plan['size']
+
+    for elem, op, (a, b) in zip(plan['order'], plan['ops'].tolist(), plan['operands'].tolist()):
+      if op == hoplite_utils.OP_INPUT:
+        propagation[elem] = pce_vector.from_dict(dists[self.input_rvars[elem]], c_matrix)
+      elif op == hoplite_utils.OP_CONST:
+        propagation[elem] = pce_vector.constant(float(nodes[elem]['value']), c_matrix)
+      elif op == hoplite_utils.OP_OUTPUT:
+        propagation[elem] = propagation[a]
+      elif op == hoplite_utils.OP_ADD:
+        propagation[elem] = propagation[a].add(propagation[b])
+      elif op == hoplite_utils.OP_SUB:
+        propagation[elem] = propagation[a].sub(propagation[b])
+      elif op == hoplite_utils.OP_MUL:
+        propagation[elem] = propagation[a].mul(propagation[b])
+      elif op == hoplite_utils.OP_NOISE:
+        propagation[elem] = propagation[a].add(pce_vector.from_dict(self.noise_dists[nodes[elem]['symbol']], c_matrix))
+
+    return [x.to_dict() if not x is None else None for x in propagation]
 
   # add_noises_to(nodes, graph)
   #
@@ -299,12 +349,14 @@ class model_megpc:
         self.noise_inputs.append(name)
         self.noise_dists.update({vSymbol: {1.0*vSymbol: (2**(-wlSymbol))/2}})
 
-      node = {node_id: {'op': 'noise', 'preds': [n], 'succs': graph['nodes'][n]['succs'], 'symbol': vSymbol}}
+      node = {node_id: {'op': 'noise', 'preds': [n], 'succs': list(graph['nodes'][n]['succs']), 'symbol': vSymbol}}
 
+      # The nodes may be shared with other graphs, so they are replaced
+      #  instead of modified.
       graph['nodes'].update(node)
       for i in graph['nodes'][n]['succs']:
-        graph['nodes'][i]['preds'] = [p if p != n else node_id for p in graph['nodes'][i]['preds']]
-      graph['nodes'][n]['succs'] = [node_id]
+        graph_view.update(graph['nodes'], i, preds=[p if p != n else node_id for p in graph['nodes'][i]['preds']])
+      graph_view.update(graph['nodes'], n, succs=[node_id])
 
     self.noise_inputs = sorted(self.noise_inputs, key=lambda x: int(x.split('_')[1]))
     self.noise_rvars  = [self.noise_equivs[x][0] for x in self.noise_inputs]
@@ -336,193 +388,15 @@ class model_megpc:
 
   # get_execution_paths()
   #
-  # Goes over the system graph several times getting the different execution
-  #  paths in it. It takes care of generating the paths, elimiating the dead
-  #  code and annotating the dependence chains of the different flow-control
-  #  nodes so that we can later compute the probabilities of each path.
-  #
-  # It truly does a lot of things.
+  # Goes over the system graph getting the different execution paths in
+  #  it. See exec_paths.get_execution_paths() for the details. The
+  #  execution plans of the paths and their cmp trees are compiled here.
   #
   def get_execution_paths(self):
-    # Get all the BBs that have a conditional branch and, thus, a fork.
-    all_branches = [x for x in self.original_source['nodes'] if self.original_source['nodes'][x]['op'] == 'br']
-    cond_branches = [x for x in all_branches if not self.original_source['nodes'][self.original_source['nodes'][x]['preds'][0]]['cmp'] in ['TRUE', 'FALSE']]
-    cond_cmps = [self.original_source['nodes'][x]['preds'][0] for x in cond_branches]
-
-    forks = {}
-    for c in cond_branches:
-      for bb in self.original_source['bbs']:
-        if c in self.original_source['bbs'][bb]['nodes']: forks[bb] = self.original_source['bbs'][bb]['succs']
-    
-    # Generate all the possible path combinations.
-    choices = product([0,1], repeat=len(forks))
-    forks_list = sorted(forks.keys())
-
-    # Generate all the possible paths, selecting only one of the two
-    #  directions in each of the forks in the system graph.
-    paths = []
-    for c in choices:
-      lc = list(c)
-      new_path = copy.deepcopy(self.original_source)
-
-      # Step 1: Transform all forks in execution paths into
-      #  univocal paths by leaving every BB with just one
-      #  successor.
-      for f in range(len(forks_list)):
-        s = new_path['bbs'][forks_list[f]]['succs'][lc[f]]
-        del new_path['bbs'][forks_list[f]]['succs'][lc[f]]
-        if s in new_path['bbs'][0]['succs']:
-          del new_path['bbs'][0]['succs'][new_path['bbs'][0]['succs'].index(s)]
-
-      # At this point, only Basic Block successors information is
-      #  reliable. The predecessors info has to be corrected, and
-      #  the branch and phi nodes will dissapear since now they
-      #  will always go to and come from the same path.
-
-      # Step 2: Clear all predecessors information from the BBs.
-      for bb in new_path['bbs']:
-        new_path['bbs'][bb]['preds'] = []
-
-      # Step 3: Rebuild the precessors info with the successors one.
-      for bb in new_path['bbs']:
-        for bs in new_path['bbs'][bb]['succs']:
-          new_path['bbs'][bs]['preds'].append(bb)
-
-      # Step 4: Eliminate all unreachable BBs. That implies
-      #  removing the BB as well as all its nodes.
-      #  In the process, annotate the nodes that will
-      #  be deleted afterwards.
-      nodes_to_delete = []
-      deleted_bbs = True
-      while deleted_bbs:
-        deleted_bbs = False
-        bbs_to_delete = []
-        for bb in [x for x in new_path['bbs'] if not new_path['bbs'][x]['preds']]:
-          nodes_to_delete += new_path['bbs'][bb]['nodes']
-          for bs in new_path['bbs'][bb]['succs']:
-            new_path['bbs'][bs]['preds'].remove(bb)
-          del new_path['bbs'][bb]
-          deleted_bbs = True
-
-      # Step 5: Transform all phi nodes in bypass nodes.
-      #  Bypass nodes are a temporary concept intended to
-      #  just eliminate the input pairs and the multiple
-      #  possible sources.
-      #  All bypass nodes have 1 pred and N succs.
-      for n in [x for x in new_path['nodes'] if new_path['nodes'][x]['op'] == 'phi']:
-        new_path['nodes'][n]['op'] = 'bypass'
-        for p in new_path['nodes'][n]['preds']:
-          if p[0] in new_path['bbs']:
-            new_preds = [p[1]]
-            break
-        new_path['nodes'][n]['preds'] = new_preds
-
-      # Step 6: Remove all bypass nodes.
-      #  When, in the previous comment, I said "temporary"
-      #  I really meant it.
-      for n in [x for x in new_path['nodes'] if new_path['nodes'][x]['op'] == 'bypass']:
-        # Add all successors of the node as successors of the predecessor.
-        p = new_path['nodes'][n]['preds'][0]
-        new_path['nodes'][p]['succs'] += new_path['nodes'][n]['succs']
-        new_path['nodes'][p]['succs'].remove(n)
-
-        # Replace the node in the predecessors lists of all its successors
-        #  with its predecessor.
-        for s in new_path['nodes'][n]['succs']:
-          for i in range(len(new_path['nodes'][s]['preds'])):
-            if new_path['nodes'][s]['preds'][i] == n:
-              new_path['nodes'][s]['preds'][i] = p
-
-        # And delete the node once and for all.
-        del new_path['nodes'][n]
-
-      # Step 7: Delete branches.
-      for n in [x for x in new_path['nodes'] if new_path['nodes'][x]['op'] == 'br']:
-        p = new_path['nodes'][n]['preds'][0]
-        new_path['nodes'][p]['succs'].remove(n)
-        del new_path['nodes'][n]
-
-      # Step 8: Save the branch-related CMP operations for later study.
-      cmp_trees = {}
-      for n in [x for x in new_path['nodes']
-          if (new_path['nodes'][x]['op'] == 'cmp' and
-            not new_path['nodes'][x]['cmp'] in ['TRUE', 'FALSE'] and
-            not new_path['nodes'][x]['succs'])]:
-        cmp_trees[n] = self.get_subgraph_for(n, new_path['nodes'])
-
-      # Step 9: Delete all hanging nodes: Those that are not outputs
-      #  but have no successors. They are dead code that has to be
-      #  eliminated.
-      while nodes_to_delete:
-        while nodes_to_delete: # Yes. A double loop. This is how I roll.
-          n = nodes_to_delete.pop()
-          if n in new_path['nodes']:
-            del new_path['nodes'][n]
-        for n in new_path['nodes']:
-          new_path['nodes'][n]['succs'] = [x for x in new_path['nodes'][n]['succs'] if x in new_path['nodes']]
-        nodes_to_delete += [x for x in new_path['nodes'] 
-          if (not new_path['nodes'][x]['op'] == 'output' and
-              not new_path['nodes'][x]['succs'])]
-
-      # 9.2: Remove all deleted nodes from their corresponding BBs.
-      for bb in new_path['bbs']:
-        new_path['bbs'][bb]['nodes'] = [x for x in new_path['bbs'][bb]['nodes'] if x in new_path['nodes']]
-
-      # 9.3: Update inputs and outputs information.
-      new_path['inputs']  = [x for x in new_path['inputs']  if x in new_path['nodes']]
-      new_path['outputs'] = [x for x in new_path['outputs'] if x in new_path['nodes']]
-
-      # Step 10: Pack everything, wrap it nicely and return it.
-
-      # 10.1: Match cmp nodes with their BBs
-      cmps_for_bbs = {}
-      for n in cmp_trees.keys():
-        bb_list = [x for x in self.original_source['bbs'] if n in self.original_source['bbs'][x]['nodes']]
-        if bb_list:
-          bb = [x for x in self.original_source['bbs'] if n in self.original_source['bbs'][x]['nodes']][0]
-          cmps_for_bbs[bb] = n
-
-      # 10.2: Retrieve the information of the decision taken in
-      #  each decisor.
-      decisions = {}
-      for i in range(len(forks)):
-        if forks_list[i] in new_path['bbs']:
-          # We have to invert the selections here because at the beginning of the function
-          #  lc was the decision that got deleted.
-          decisions[cmps_for_bbs[forks_list[i]]] = {0: False, 1: True}[lc[i]]
-
-      # 10.3: Insert the path in the execution paths graph only if
-      #  it was not there before.
-      if not decisions in [x['decisions'] for x in paths]:
-        paths.append({'decisions': decisions, 'path': new_path, 'cmp_trees': cmp_trees})
-
-    return paths
+    return [hoplite_utils.add_execution_plans(path) for path in exec_paths.get_execution_paths(self.original_source)]
 
   def get_subgraph_for(self, node_id, graph):
-    # Generate list of all the predecessors of the node node_id
-    op_preds = []
-    new_preds = [node_id]
-    while new_preds:
-      node = new_preds.pop()
-      op_preds.append(node)
-
-      for pred in graph[node]['preds']:
-          new_preds.append(pred)
-
-    op_preds = list(set(op_preds))
-
-    # Copy the graph and delete every node
-    #  that doesn't precede node node_id
-    subgraph = copy.deepcopy(graph)
-
-    for n in [x for x in subgraph if x not in op_preds]:
-      del subgraph[n]
-
-    # Remove all successors that are not in the graph.
-    for n in subgraph:
-      subgraph[n]['succs'] = [x for x in subgraph[n]['succs'] if x in subgraph]
-
-    return subgraph
+    return exec_paths.get_subgraph_for(node_id, graph)
 
   # apply_model(path, domain)
   #
@@ -548,6 +422,23 @@ class model_megpc:
 
     print len(me_gpc_partitions), "ME-gPC partitions found in this execution path."
 
+    # The noised graphs and C matrices of the groups do not depend on
+    #  the partition, so they are built only once and their execution
+    #  plans are replayed for every partition.
+    noised_groups = []
+    for group in noise_groups:
+      group_graph = graph_view.derive(path['path'])
+      self.add_noises_to(group, group_graph)
+      hoplite_utils.add_execution_plan(group_graph)
+      used_inputs = [self.input_to_rvars[i] for i in path['path']['inputs']]
+      # Generate C matrix for each group of random variables.
+      noised_c_matrix = c_matrix.c_matrix(used_inputs + [self.noise_equivs['n_' + str(v)][0] for v in group], self.order, self.c_matrix_workers, lazy=self.c_matrix_lazy)
+      noised_groups.append((group_graph, noised_c_matrix))
+
+      # Update the expectances with the results from this group.
+      for x in noised_c_matrix.expectances:
+        self.noised_expectances[x] = noised_c_matrix.expectances[x]
+
     # Solve the system for each partition.
     outputs = []
     for partition in me_gpc_partitions:
@@ -555,19 +446,10 @@ class model_megpc:
       clean_outputs = {x: partition['propagation'][x] for x in path['path']['outputs']}
 
       noise_propagations = []
-      for group in noise_groups:
-        group_graph = copy.deepcopy(path['path'])
-        self.add_noises_to(group, group_graph)
-        used_inputs = [self.input_to_rvars[i] for i in path['path']['inputs']]
-        # Generate C matrix for each group of random variables.
-        noised_c_matrix = c_matrix.c_matrix(used_inputs + [self.noise_equivs['n_' + str(v)][0] for v in group], self.order)
+      for (group_graph, noised_c_matrix) in noised_groups:
         # Propagate the PCE coefficients through the system.
         iter_coeffs = dict(partition['distributions'].items() + self.noise_dists.items())
-        noise_propagations.append(self.propagate(group_graph['nodes'], iter_coeffs, noised_c_matrix))
-
-        # Update the expectances with the results from this iteration.
-        for x in noised_c_matrix.expectances:
-          self.noised_expectances[x] = noised_c_matrix.expectances[x]
+        noise_propagations.append(self.propagate(group_graph, iter_coeffs, noised_c_matrix))
 
       noised_outputs = {}
       for output in path['path']['outputs']:
@@ -637,10 +519,11 @@ class model_megpc:
 
   # generate_A_matrix(vars)
   #
-  # Matrix A is a matrix of uniform random points in [-1,1]^d.
-  #  It has as many rows as elements in the base, and as many
-  #  columns as random variables in the input. Actually, the
-  #  structure will be a dictionary.
+  # Matrix A holds the elements of the base evaluated at as many
+  #  uniform random points in [-1,1]^d as elements in the base, one
+  #  point per row. It is returned as a float array, together with
+  #  the points, as a matrix with one column per variable of the
+  #  clean base.
   #
   def generate_A_matrix(self, vars):
     random.seed()
@@ -648,15 +531,23 @@ class model_megpc:
     tuples = [(i, j) for i in range(base_length) for j in vars]
     random_points = {r: random.uniform(-1,1) for r in tuples}
 
-    a_matrix = []
-    for i in range(base_length):
-      a_matrix.append(self.clean_c_matrix.base[:])
+    points = numpy.zeros((base_length, len(self.clean_c_matrix.vars)))
+    for (i, v), value in random_points.iteritems():
+      points[i, self.clean_c_matrix.vars.index(v)] = value
+    a_matrix = self.clean_c_matrix.evaluate_base(points)
 
-    for key in random_points:
-      for elem in range(base_length):
-        a_matrix[key[0]][elem] = a_matrix[key[0]][elem].subs(key[1], random_points[key])
+    return a_matrix, points
 
-    return a_matrix, random_points
+  # get_projection(vars)
+  #
+  # Generates a set of random points and returns them together with
+  #  the pseudo-inverse of their A matrix. Multiplying it by the values
+  #  of a function at the points projects the function on the base,
+  #  as the least squares solution of A x = u.
+  #
+  def get_projection(self, vars):
+    a_matrix, points = self.generate_A_matrix(vars)
+    return points, linalg.pinv(a_matrix)
 
   # evaluate_partition(partition)
   #
@@ -668,9 +559,12 @@ class model_megpc:
   #  result to go one way or the other, depending on how many values pointed
   #  in one direction or the other.
   #
+  # The direction is sampled at up to mc_points random points of the
+  #  domain, evaluating the expansions of both sides of the comparison
+  #  numerically (see fork_sampling.decide_fork()).
+  #
   def evaluate_partition(self, partition):
-    p = copy.deepcopy(partition)
-    base_length = len(self.clean_c_matrix.base)
+    p = dict(partition)
 
     fork_index = partition['decisions'].index(None)
     fork = partition['forks'][fork_index]
@@ -679,38 +573,16 @@ class model_megpc:
 
     # Get the results of expanding the coefficients through the decision tree.
     propagation = self.propagate(tree, p['distributions'], self.clean_c_matrix)
-    lhs = propagation[tree[fork]['preds'][0]]
-    rhs = propagation[tree[fork]['preds'][1]]
-
-    # Generate a number of uniform random points in the domain.
-    tuples = [(i, j) for i in range(base_length) for j in p['distributions'].keys()]
-    random_points = {r: random.uniform(-1,1) for r in tuples}
-
-    # Calculate the complete polynomial.
-    val_lhs = sympy.S(0.0)
-    val_rhs = sympy.S(0.0)
-    for k in lhs: val_lhs += k*lhs[k]
-    for k in rhs: val_rhs += k*rhs[k]
-
-    # Generate the corresponding tuples for replacement.
-    replacement_tuples = [[] for x in range(base_length)]
-    for point in random_points:
-      replacement_tuples[point[0]].append((point[1],random_points[point]))
-
-    # Replace the random variables with its value in each random point
-    #  and evaluate the outcome of the inequation in it.
-    replacement_value = 0
-    for t in replacement_tuples:
-      s_val_lhs = val_lhs.subs(t) 
-      s_val_rhs = val_rhs.subs(t)
-      replacement_value += self.evaluate(s_val_lhs, s_val_rhs, tree[fork]['cmp'])
+    lhs = propagation[tree['nodes'][fork]['preds'][0]]
+    rhs = propagation[tree['nodes'][fork]['preds'][1]]
 
     # Determine if the direction of the fork has been established or not.
-    decisions[fork_index] = {0: False, base_length: True}.get(replacement_value, None)
-    # In case we reach the limit set up by system parameters, decide the
+    #  In case we reach the limit set up by system parameters, decide the
     #  fork direction strictly. This behaviour must be changed from here
     #  if needed.
-    if p['j_k'] <= self.j_lim: decisions[fork_index] = replacement_value >= (base_length / 2)
+    decisions[fork_index] = fork_sampling.decide_fork(self.clean_c_matrix, lhs, rhs, tree['nodes'][fork]['cmp'],
+                                                      p['distributions'].keys(), p['j_k'] <= self.j_lim,
+                                                      self.mc_points, self.mc_confidence)
     p['decisions'] = tuple(decisions)
 
     return p
@@ -728,20 +600,23 @@ class model_megpc:
     if on_vars is None:
       vars = partition['distributions'].keys()
     else:
-      vars = copy.deepcopy(on_vars)
+      vars = list(on_vars)
+
+    partitions = [dict(partition)]
 
-    partitions = [copy.deepcopy(partition)]
+    # All the splits share the same points and pseudo-inverse of A.
+    projection = self.get_projection(partition['distributions'].keys())
 
     while vars:
       v = vars.pop()
       new_partitions = []
       while partitions:
         p = partitions.pop()
-        new_partitions += self.split_on(p,v)
+        new_partitions += self.split_on(p,v,projection)
       partitions = new_partitions
     return partitions
 
-  # split_on(partition, var)
+  # split_on(partition, var[, projection])
   #
   # This method for splitting a random variable follows the procedure
   #  explained in:
@@ -749,12 +624,20 @@ class model_megpc:
   #     generalized polynomial chaos method for stochastic differential
   #     equations. Journal of Computational Physics, 209(2), 617-642.
   #
-  def split_on(self, partition, var):
-    p0 = copy.deepcopy(partition)
-    p1 = copy.deepcopy(partition)
+  # The projection (points and pseudo-inverse of A) can be given to
+  #  share it between splits. Otherwise a new one is generated.
+  #
+  def split_on(self, partition, var, projection=None):
+    # The new partitions share everything but the domain and the
+    #  distributions with the parent, which are only replaced, never
+    #  modified.
+    p0 = dict(partition, domain=dict(partition['domain']), distributions=dict(partition['distributions']))
+    p1 = dict(partition, domain=dict(partition['domain']), distributions=dict(partition['distributions']))
 
     base_length = len(self.clean_c_matrix.base)
-    a_matrix, random_points = self.generate_A_matrix(partition['distributions'].keys())
+    if projection is None:
+      projection = self.get_projection(partition['distributions'].keys())
+    points, pseudo_inverse = projection
 
     # 'fork', 'tree' and 'direction' are the same as in the parent.
     # 'j_k'
@@ -767,28 +650,22 @@ class model_megpc:
     p1['domain'][var] = (middle_point, partition['domain'][var][1])
 
     # 'distributions'
+    # The expansion of the variable is evaluated at the points with the
+    #  variable rescaled to each half, [-1,0] and [0,1], and projected
+    #  on the base to get the expansions in the new subdomains.
     coeffs = partition['distributions'][var]
-    upper = Symbol('upper')
-    lower = Symbol('lower')
-    resize_form = ((upper - lower) / 2) * var + (upper + lower) / 2;
-
-    equation = 0.0
-    for c in coeffs: equation += c*coeffs[c]
-    equation = equation.subs(var, resize_form)
-
-    u_hat_0 = []
-    u_hat_1 = []
+    column = self.clean_c_matrix.vars.index(var)
 
-    for i in range(base_length):
-      all_subs = [(v, random_points[(i,v)]) for v in partition['distributions'].keys()]
-      u_hat_0.append([equation.subs([(lower,-1),(upper,0)] + all_subs)])
-      u_hat_1.append([equation.subs([(lower, 0),(upper,1)] + all_subs)])
+    u_hat = numpy.zeros((base_length, 2))
+    for n, (lower, upper) in enumerate([(-1.0, 0.0), (0.0, 1.0)]):
+      resized = points.copy()
+      resized[:, column] = ((upper - lower) / 2) * points[:, column] + (upper + lower) / 2
+      u_hat[:, n] = self.clean_c_matrix.evaluate_expansion(coeffs, resized)
 
-    coeffs_0 = [x[0] for x in list(linalg.lstsq(a_matrix,u_hat_0)[0])]
-    coeffs_1 = [x[0] for x in list(linalg.lstsq(a_matrix,u_hat_1)[0])]
+    coeffs_0, coeffs_1 = pseudo_inverse.dot(u_hat).T
 
-    new_coeffs_0 = {self.clean_c_matrix.base[i]: coeffs_0[i] for i in range(base_length) if abs(coeffs_0[i]) > 1e-12}
-    new_coeffs_1 = {self.clean_c_matrix.base[i]: coeffs_1[i] for i in range(base_length) if abs(coeffs_1[i]) > 1e-12}
+    new_coeffs_0 = {self.clean_c_matrix.base[i]: float(coeffs_0[i]) for i in range(base_length) if abs(coeffs_0[i]) > 1e-12}
+    new_coeffs_1 = {self.clean_c_matrix.base[i]: float(coeffs_1[i]) for i in range(base_length) if abs(coeffs_1[i]) > 1e-12}
 
     p0['distributions'][var] = new_coeffs_0
     p1['distributions'][var] = new_coeffs_1
@@ -815,7 +692,7 @@ class model_megpc:
 
     to_solution = []
     # Generate initial solution
-    propagation = self.propagate(path['path']['nodes'], domain['coeffs'], self.clean_c_matrix)
+    propagation = self.propagate(path['path'], domain['coeffs'], self.clean_c_matrix)
     partition = { 'distributions': domain['coeffs'],
                   'domain':        domain['domain'],
                   'propagation':   propagation,
@@ -830,7 +707,7 @@ class model_megpc:
       if to_split:
         new_partitions = self.split(p, to_split)
         for p in range(len(new_partitions)):
-          new_partitions[p]['propagation'] = self.propagate(path['path']['nodes'], new_partitions[p]['distributions'], self.clean_c_matrix)
+          new_partitions[p]['propagation'] = self.propagate(path['path'], new_partitions[p]['distributions'], self.clean_c_matrix)
         to_study += new_partitions
         print len(to_study), 'partitoins now pending to be studied.'
       else:
@@ -17,6 +17,7 @@ sys.path.insert(0,parentdir)
 import hoplite_utils
 from lib import c_matrix
 from lib import pce_ops
+from lib import pce_vector
 
 class model_pce:
   def __init__(self, config, source_config, source, destination, partitioner=None):
@@ -68,6 +69,7 @@ class model_pce:
     for group in noise_groups:
       group_graph = copy.deepcopy(self.clean_source)
       self.add_noises_to(group, group_graph)
+      hoplite_utils.add_execution_plan(group_graph)
       # Generate C matrix for each group of random variables.
       noised_c_matrix = c_matrix.c_matrix(self.input_rvars + [self.noise_equivs['n_' + str(v)][0] for v in group], self.order)
       # Propagate the PCE coefficients through the system.
@@ -92,19 +94,26 @@ class model_pce:
     for o in self.noised_outputs:
       print o, ':', self.noised_outputs[o]
 
-  def get_noise_mean(self, output, wlv):
+  # The noise and signal queries take the same arguments as in the
+  #  other models: without an output, they return the values of all of
+  #  them, in the order of the outputs of the system.
+  def get_noise_mean(self, wlv, output=None):
     if not self.computed:
       sys.exit("System has not been computed")
+    if output is None:
+      return [self.get_noise_mean(wlv, x) for x in self.clean_source['outputs']]
     return abs((self.signal_propagation[output][sympy.S(1.0)] - self.noised_outputs[output][sympy.S(1.0)]).subs(zip(self.noise_wlvars, wlv)))
 
-  def get_noise_variance(self, output, wlv):
+  def get_noise_variance(self, wlv, output=None):
     if not self.computed:
       sys.exit("System has not been computed")
+    if output is None:
+      return [self.get_noise_variance(wlv, x) for x in self.clean_source['outputs']]
     result = 0.0
     for i in self.noised_outputs[output]:
       if not i == sympy.S(1.0):
         result += (self.signal_propagation[output].get(i, 0.0) - self.noised_outputs[output].get(i, 0.0))**2
-    return (result).subs(zip(self.noise_wlvars, wlv))/3
+    return sympy.S(result).subs(zip(self.noise_wlvars, wlv))/3
 
   # -----------------------------------------------------------------
   # AUXILIAR FUNCTIONS
@@ -115,32 +124,31 @@ class model_pce:
   #
   def propagate(self, source, c_matrix):
     nodes = source['nodes']
-    propagation = [None] * (max(source['nodes'].keys()) + 1)
-
-    execution_order = hoplite_utils.get_execution_order(nodes)
-
-    for elem in execution_order:
-      if nodes[elem]['op'] == 'input':
-        propagation[elem] = self.input_dists[self.input_rvars[elem]]
-      if nodes[elem]['op'] == 'const':
-        propagation[elem] = {sympy.S(1.0):float(nodes[elem]['value'])}
-      if nodes[elem]['op'] == 'output':
-        propagation[elem] = propagation[nodes[elem]['preds'][0]]
-      if nodes[elem]['op'] == 'add':
-        propagation[elem] = pce_ops.add(propagation[nodes[elem]['preds'][0]], propagation[nodes[elem]['preds'][1]])
-      if nodes[elem]['op'] == 'sub':
-        propagation[elem] = pce_ops.sub(propagation[nodes[elem]['preds'][0]], propagation[nodes[elem]['preds'][1]])
-      if nodes[elem]['op'] == 'mul':
-        propagation[elem] = pce_ops.mul(propagation[nodes[elem]['preds'][0]], propagation[nodes[elem]['preds'][1]], c_matrix)
-      if nodes[elem]['op'] == 'noise':
-        propagation[elem] = pce_ops.add(propagation[nodes[elem]['preds'][0]], self.noise_dists[nodes[elem]['symbol']])
-      if nodes[elem]['op'] == 'div':
+    plan  = source['plan']
+    propagation = [None] * plan['size']
+
+    for elem, op, (a, b) in zip(plan['order'], plan['ops'].tolist(), plan['operands'].tolist()):
+      if op == hoplite_utils.OP_INPUT:
+        propagation[elem] = pce_vector.from_dict(self.input_dists[self.input_rvars[elem]], c_matrix)
+      elif op == hoplite_utils.OP_CONST:
+        propagation[elem] = pce_vector.constant(float(nodes[elem]['value']), c_matrix)
+      elif op == hoplite_utils.OP_OUTPUT:
+        propagation[elem] = propagation[a]
+      elif op == hoplite_utils.OP_ADD:
+        propagation[elem] = propagation[a].add(propagation[b])
+      elif op == hoplite_utils.OP_SUB:
+        propagation[elem] = propagation[a].sub(propagation[b])
+      elif op == hoplite_utils.OP_MUL:
+        propagation[elem] = propagation[a].mul(propagation[b])
+      elif op == hoplite_utils.OP_NOISE:
+        propagation[elem] = propagation[a].add(pce_vector.from_dict(self.noise_dists[nodes[elem]['symbol']], c_matrix))
+      elif op == hoplite_utils.OP_DIV:
         print nodes[elem]
-        print propagation[nodes[elem]['preds'][0]]
-        print propagation[nodes[elem]['preds'][1]]
+        print propagation[a]
+        print propagation[b]
         sys.exit()
 
-    return propagation
+    return [x.to_dict() if not x is None else None for x in propagation]
 
   def add_noises_to(self, nodes, graph):
     max_id = max(graph['nodes'].keys())
@@ -162,14 +170,18 @@ class model_pce:
         graph['nodes'][i]['preds'] = [p if p != n else node_id for p in graph['nodes'][i]['preds']]
       graph['nodes'][n]['succs'] = [node_id]
 
-  def get_signal_mean(self, output):
+  def get_signal_mean(self, output=None):
     if not self.computed:
       sys.exit("System has not been computed")
+    if output is None:
+      return [self.get_signal_mean(x) for x in self.clean_source['outputs']]
     return (self.signal_propagation[output][sympy.S(1.0)])
 
-  def get_signal_variance(self, output):
+  def get_signal_variance(self, output=None):
     if not self.computed:
       sys.exit("System has not been computed")
+    if output is None:
+      return [self.get_signal_variance(x) for x in self.clean_source['outputs']]
     result = 0.0
     for i in self.signal_propagation[output]:
       if not i == sympy.S(1.0):
@@ -6,7 +6,10 @@
 import sys
 import copy
 import time
+import pickle
+import hashlib
 import random
+import numpy
 import scipy
 import sympy
 
@@ -19,7 +22,14 @@ sys.path.insert(0,parentdir)
 
 import hoplite_utils
 from lib import c_matrix
+from lib import c_store
 from lib import pce_ops
+from lib import pce_vector
+from lib import noise_poly
+from lib import exec_paths
+from lib import graph_view
+from lib import fork_sampling
+from lib import generic_outputs
 
 from itertools import product
 
@@ -30,6 +40,8 @@ class model_pce_cond:
     self.order          = config['pce_cond_order']
     self.partition_size = config['pce_cond_partition_size']
     self.j_lim          = config['pce_cond_j_lim']
+    self.mc_points      = config.get('pce_cond_mc_points', 1000)
+    self.mc_confidence  = config.get('pce_cond_mc_confidence', 0.99)
 
     self.original_source = source
 
@@ -38,7 +50,9 @@ class model_pce_cond:
     self.input_to_rvars = {source['inputs'][i]: self.input_rvars[i] for i in range(len(self.signal_inputs))}
     self.input_dists    = source_config.get('distributions', {x: {1.0*x: 1.0} for x in self.input_rvars})
 
-    self.clean_c_matrix = c_matrix.c_matrix(self.input_rvars, self.order)
+    self.c_matrix_workers = config.get('c_matrix_workers', None)
+    self.c_matrix_lazy    = config.get('c_matrix_lazy', False)
+    self.clean_c_matrix = c_matrix.c_matrix(self.input_rvars, self.order, self.c_matrix_workers)
 
     self.noised_expectances = {}
 
@@ -60,7 +74,13 @@ class model_pce_cond:
 
     self.computed = False
 
+    # The precomputed paths are kept out of the destination, which is a
+    #  new folder for every run unless one is given, so later runs find
+    #  them. By default they go with the stored C matrices.
     self.precomputed_paths = {}
+    self.precomputed_files = config.get('pce_cond_precomputed_dir', None)
+    if self.precomputed_files is None:
+      self.precomputed_files = os.path.join(c_store.get_directory(), 'precomputed_paths')
 
   def compute(self):
     total_time = time.time()
@@ -125,11 +145,14 @@ class model_pce_cond:
     for o in self.noise_mean:
       self.noise_mean[o] = sum([x[0][o].get(sympy.S(1.0), 0.0)*x[1] for x in self.noised_results])
       print o, "-", self.noise_mean[o]
+    for o in self.noise_variance:
+      self.noise_variance[o] = sympy.Add(*[(b[0][o][x]**2)*b[1]*self.noised_expectances[x] for b in self.noised_results for x in b[0][o] if not x == sympy.S(1.0)])
 
     print "Total number of noises:", len(self.noise_inputs)
     print("Total computing time: %s seconds" % (time.time() - total_time))
 
     self.num_noises = len(self.noise_inputs)
+    self.compile_noise_polys()
     self.computed = True
 
   # get_noise_mean(output, wlv)
@@ -144,9 +167,9 @@ class model_pce_cond:
     if not self.computed:
       sys.exit("System has not been computed")
     if output is None:
-      return [n.subs(zip(self.noise_wlvars, wlv)) for n in self.noise_mean]
+      return [self.noise_mean_polys[o].evaluate(wlv) for o in self.original_source['outputs']]
     else:
-      return self.noise_mean[self.original_source['outputs'].index(output)].subs(zip(self.noise_wlvars, wlv))
+      return self.noise_mean_polys[output].evaluate(wlv)
 
   # get_noise_variance(output, wlv)
   #
@@ -156,50 +179,84 @@ class model_pce_cond:
   def get_noise_variance(self, wlv, output=None):
     if not self.computed:
       sys.exit("System has not been computed")
+    if output is None:
+      return [self.noise_variance_polys[o].evaluate(wlv) for o in self.original_source['outputs']]
+    else:
+      return self.noise_variance_polys[output].evaluate(wlv)
 
-    if not output:
-      return [self.get_noise_variance(wlv, o) for o in self.original_source['outputs']]
+  # get_noise_variances(wlvs)
+  #
+  # Computes the noise variance values of all the output signals for
+  #  a batch of WordLength Vectors in a single call. Returns an array
+  #  with one row per WLV and one column per output.
+  #
+  def get_noise_variances(self, wlvs):
+    if not self.computed:
+      sys.exit("System has not been computed")
+    wlvs = numpy.asarray(wlvs, dtype=numpy.float64).reshape(-1, len(self.noise_wlvars))
+    return numpy.column_stack([self.noise_variance_polys[o].evaluate(wlvs) for o in self.original_source['outputs']])
 
-    print self.noised_expectances
+  # delta_variance(wlv, index, new_wl, output=None)
+  #
+  # Computes the change of the noise variance of the indicated output
+  #  signal (or of all of them) when the word-length of the given index
+  #  of the WordLength Vector is set to new_wl. Only the terms of the
+  #  noise variance that depend on that word-length are evaluated.
+  #
+  def delta_variance(self, wlv, index, new_wl, output=None):
+    if not self.computed:
+      sys.exit("System has not been computed")
+    if output is None:
+      return [self.noise_variance_polys[o].delta(wlv, index, new_wl) for o in self.original_source['outputs']]
+    else:
+      return self.noise_variance_polys[output].delta(wlv, index, new_wl)
 
-    zipped = zip(self.noise_wlvars, wlv)
-    return sum([(b[0][output][x]**2)*b[1]*self.noised_expectances[x].subs(zipped) for b in self.noised_results for x in b[0][output] if not x == sympy.S(1.0)])
+  # compile_noise_polys()
+  #
+  # Compiles the aggregated noise mean and variance expressions of
+  #  the outputs into noise polynomials, so they are evaluated with
+  #  NumPy instead of substituting the WLV in the sympy expressions.
+  #
+  def compile_noise_polys(self):
+    self.noise_mean_polys     = {o: noise_poly.noise_poly(self.noise_mean[o], self.noise_wlvars) for o in self.noise_mean}
+    self.noise_variance_polys = {o: noise_poly.noise_poly(self.noise_variance[o], self.noise_wlvars) for o in self.noise_variance}
 
   # -----------------------------------------------------------------
   # AUXILIAR FUNCTIONS
   # -----------------------------------------------------------------
 
-  # propagate(source, c_matrix)
+  # propagate(graph, dists, c_matrix)
   #
-  # Propagates the PCE coefficients through the system.
+  # Propagates the PCE coefficients through the system, following the
+  #  execution plan stored with the graph.
   #
-  def propagate(self, source, dists, c_matrix):
+  def propagate(self, graph, dists, c_matrix):
+    nodes = graph['nodes']
     start_time = time.time()
-    propagation = [None] * (max(source.keys()) + 1)
-
-    execution_order = hoplite_utils.get_execution_order(source)
-
-    for elem in execution_order:
-      if source[elem]['op'] == 'input':
-        propagation[elem] = dists[self.input_rvars[elem]]
-      if source[elem]['op'] == 'const':
-        propagation[elem] = {sympy.S(1.0):float(source[elem]['value'])}
-      if source[elem]['op'] == 'output':
-        propagation[elem] = propagation[source[elem]['preds'][0]]
-      if source[elem]['op'] == 'add':
-        propagation[elem] = pce_ops.add(propagation[source[elem]['preds'][0]], propagation[source[elem]['preds'][1]])
-      if source[elem]['op'] == 'sub':
-        propagation[elem] = pce_ops.sub(propagation[source[elem]['preds'][0]], propagation[source[elem]['preds'][1]])
-      if source[elem]['op'] == 'mul':
-        propagation[elem] = pce_ops.mul(propagation[source[elem]['preds'][0]], propagation[source[elem]['preds'][1]], c_matrix)
-      if source[elem]['op'] == 'noise':
-        propagation[elem] = pce_ops.add(propagation[source[elem]['preds'][0]], self.noise_dists[source[elem]['symbol']])
+    plan = graph['plan']
+    propagation = [None] * plan['size']
+
+    for elem, op, (a, b) in zip(plan['order'], plan['ops'].tolist(), plan['operands'].tolist()):
+      if op == hoplite_utils.OP_INPUT:
+        propagation[elem] = pce_vector.from_dict(dists[self.input_rvars[elem]], c_matrix)
+      elif op == hoplite_utils.OP_CONST:
+        propagation[elem] = pce_vector.constant(float(nodes[elem]['value']), c_matrix)
+      elif op == hoplite_utils.OP_OUTPUT:
+        propagation[elem] = propagation[a]
+      elif op == hoplite_utils.OP_ADD:
+        propagation[elem] = propagation[a].add(propagation[b])
+      elif op == hoplite_utils.OP_SUB:
+        propagation[elem] = propagation[a].sub(propagation[b])
+      elif op == hoplite_utils.OP_MUL:
+        propagation[elem] = propagation[a].mul(propagation[b])
+      elif op == hoplite_utils.OP_NOISE:
+        propagation[elem] = propagation[a].add(pce_vector.from_dict(self.noise_dists[nodes[elem]['symbol']], c_matrix))
 
 
     exeution_time = time.time() - start_time
 #    print("Propagate values: %s seconds" % exeution_time) 
 
-    return propagation
+    return [x.to_dict() if not x is None else None for x in propagation]
 
   # add_noises_to(nodes, graph)
   #
@@ -222,12 +279,14 @@ class model_pce_cond:
         self.noise_inputs.append(name)
         self.noise_dists.update({vSymbol: {1.0*vSymbol: (2**(-wlSymbol))/2}})
 
-      node = {node_id: {'op': 'noise', 'preds': [n], 'succs': graph['nodes'][n]['succs'], 'symbol': vSymbol}}
+      node = {node_id: {'op': 'noise', 'preds': [n], 'succs': list(graph['nodes'][n]['succs']), 'symbol': vSymbol}}
 
+      # The nodes may be shared with other graphs, so they are replaced
+      #  instead of modified.
       graph['nodes'].update(node)
       for i in graph['nodes'][n]['succs']:
-        graph['nodes'][i]['preds'] = [p if p != n else node_id for p in graph['nodes'][i]['preds']]
-      graph['nodes'][n]['succs'] = [node_id]
+        graph_view.update(graph['nodes'], i, preds=[p if p != n else node_id for p in graph['nodes'][i]['preds']])
+      graph_view.update(graph['nodes'], n, succs=[node_id])
 
     self.noise_inputs = sorted(self.noise_inputs, key=lambda x: int(x.split('_')[1]))
     self.noise_rvars  = [self.noise_equivs[x][0] for x in self.noise_inputs]
@@ -259,193 +318,15 @@ class model_pce_cond:
 
   # get_execution_paths()
   #
-  # Goes over the system graph several times getting the different execution
-  #  paths in it. It takes care of generating the paths, elimiating the dead
-  #  code and annotating the dependence chains of the different flow-control
-  #  nodes so that we can later compute the probabilities of each path.
-  #
-  # It truly does a lot of things.
+  # Goes over the system graph getting the different execution paths in
+  #  it. See exec_paths.get_execution_paths() for the details. The
+  #  execution plans of the paths and their cmp trees are compiled here.
   #
   def get_execution_paths(self):
-    # Get all the BBs that have a conditional branch and, thus, a fork.
-    all_branches = [x for x in self.original_source['nodes'] if self.original_source['nodes'][x]['op'] == 'br']
-    cond_branches = [x for x in all_branches if not self.original_source['nodes'][self.original_source['nodes'][x]['preds'][0]]['cmp'] in ['TRUE', 'FALSE']]
-    cond_cmps = [self.original_source['nodes'][x]['preds'][0] for x in cond_branches]
-
-    forks = {}
-    for c in cond_branches:
-      for bb in self.original_source['bbs']:
-        if c in self.original_source['bbs'][bb]['nodes']: forks[bb] = self.original_source['bbs'][bb]['succs']
-    
-    # Generate all the possible path combinations.
-    choices = product([0,1], repeat=len(forks))
-    forks_list = sorted(forks.keys())
-
-    # Generate all the possible paths, selecting only one of the two
-    #  directions in each of the forks in the system graph.
-    paths = []
-    for c in choices:
-      lc = list(c)
-      new_path = copy.deepcopy(self.original_source)
-
-      # Step 1: Transform all forks in execution paths into
-      #  univocal paths by leaving every BB with just one
-      #  successor.
-      for f in range(len(forks_list)):
-        s = new_path['bbs'][forks_list[f]]['succs'][lc[f]]
-        del new_path['bbs'][forks_list[f]]['succs'][lc[f]]
-        if s in new_path['bbs'][0]['succs']:
-          del new_path['bbs'][0]['succs'][new_path['bbs'][0]['succs'].index(s)]
-
-      # At this point, only Basic Block successors information is
-      #  reliable. The predecessors info has to be corrected, and
-      #  the branch and phi nodes will dissapear since now they
-      #  will always go to and come from the same path.
-
-      # Step 2: Clear all predecessors information from the BBs.
-      for bb in new_path['bbs']:
-        new_path['bbs'][bb]['preds'] = []
-
-      # Step 3: Rebuild the precessors info with the successors one.
-      for bb in new_path['bbs']:
-        for bs in new_path['bbs'][bb]['succs']:
-          new_path['bbs'][bs]['preds'].append(bb)
-
-      # Step 4: Eliminate all unreachable BBs. That implies
-      #  removing the BB as well as all its nodes.
-      #  In the process, annotate the nodes that will
-      #  be deleted afterwards.
-      nodes_to_delete = []
-      deleted_bbs = True
-      while deleted_bbs:
-        deleted_bbs = False
-        bbs_to_delete = []
-        for bb in [x for x in new_path['bbs'] if not new_path['bbs'][x]['preds']]:
-          nodes_to_delete += new_path['bbs'][bb]['nodes']
-          for bs in new_path['bbs'][bb]['succs']:
-            new_path['bbs'][bs]['preds'].remove(bb)
-          del new_path['bbs'][bb]
-          deleted_bbs = True
-
-      # Step 5: Transform all phi nodes in bypass nodes.
-      #  Bypass nodes are a temporary concept intended to
-      #  just eliminate the input pairs and the multiple
-      #  possible sources.
-      #  All bypass nodes have 1 pred and N succs.
-      for n in [x for x in new_path['nodes'] if new_path['nodes'][x]['op'] == 'phi']:
-        new_path['nodes'][n]['op'] = 'bypass'
-        for p in new_path['nodes'][n]['preds']:
-          if p[0] in new_path['bbs']:
-            new_preds = [p[1]]
-            break
-        new_path['nodes'][n]['preds'] = new_preds
-
-      # Step 6: Remove all bypass nodes.
-      #  When, in the previous comment, I said "temporary"
-      #  I really meant it.
-      for n in [x for x in new_path['nodes'] if new_path['nodes'][x]['op'] == 'bypass']:
-        # Add all successors of the node as successors of the predecessor.
-        p = new_path['nodes'][n]['preds'][0]
-        new_path['nodes'][p]['succs'] += new_path['nodes'][n]['succs']
-        new_path['nodes'][p]['succs'].remove(n)
-
-        # Replace the node in the predecessors lists of all its successors
-        #  with its predecessor.
-        for s in new_path['nodes'][n]['succs']:
-          for i in range(len(new_path['nodes'][s]['preds'])):
-            if new_path['nodes'][s]['preds'][i] == n:
-              new_path['nodes'][s]['preds'][i] = p
-
-        # And delete the node once and for all.
-        del new_path['nodes'][n]
-
-      # Step 7: Delete branches.
-      for n in [x for x in new_path['nodes'] if new_path['nodes'][x]['op'] == 'br']:
-        p = new_path['nodes'][n]['preds'][0]
-        new_path['nodes'][p]['succs'].remove(n)
-        del new_path['nodes'][n]
-
-      # Step 8: Save the branch-related CMP operations for later study.
-      cmp_trees = {}
-      for n in [x for x in new_path['nodes']
-          if (new_path['nodes'][x]['op'] == 'cmp' and
-            not new_path['nodes'][x]['cmp'] in ['TRUE', 'FALSE'] and
-            not new_path['nodes'][x]['succs'])]:
-        cmp_trees[n] = self.get_subgraph_for(n, new_path['nodes'])
-
-      # Step 9: Delete all hanging nodes: Those that are not outputs
-      #  but have no successors. They are dead code that has to be
-      #  eliminated.
-      while nodes_to_delete:
-        while nodes_to_delete: # Yes. A double loop. This is how I roll.
-          n = nodes_to_delete.pop()
-          if n in new_path['nodes']:
-            del new_path['nodes'][n]
-        for n in new_path['nodes']:
-          new_path['nodes'][n]['succs'] = [x for x in new_path['nodes'][n]['succs'] if x in new_path['nodes']]
-        nodes_to_delete += [x for x in new_path['nodes'] 
-          if (not new_path['nodes'][x]['op'] == 'output' and
-              not new_path['nodes'][x]['succs'])]
-
-      # 9.2: Remove all deleted nodes from their corresponding BBs.
-      for bb in new_path['bbs']:
-        new_path['bbs'][bb]['nodes'] = [x for x in new_path['bbs'][bb]['nodes'] if x in new_path['nodes']]
-
-      # 9.3: Update inputs and outputs information.
-      new_path['inputs']  = [x for x in new_path['inputs']  if x in new_path['nodes']]
-      new_path['outputs'] = [x for x in new_path['outputs'] if x in new_path['nodes']]
-
-      # Step 10: Pack everything, wrap it nicely and return it.
-
-      # 10.1: Match cmp nodes with their BBs
-      cmps_for_bbs = {}
-      for n in cmp_trees.keys():
-        bb_list = [x for x in self.original_source['bbs'] if n in self.original_source['bbs'][x]['nodes']]
-        if bb_list:
-          bb = [x for x in self.original_source['bbs'] if n in self.original_source['bbs'][x]['nodes']][0]
-          cmps_for_bbs[bb] = n
-
-      # 10.2: Retrieve the information of the decision taken in
-      #  each decisor.
-      decisions = {}
-      for i in range(len(forks)):
-        if forks_list[i] in new_path['bbs']:
-          # We have to invert the selections here because at the beginning of the function
-          #  lc was the decision that got deleted.
-          decisions[cmps_for_bbs[forks_list[i]]] = {0: False, 1: True}[lc[i]]
-
-      # 10.3: Insert the path in the execution paths graph only if
-      #  it was not there before.
-      if not decisions in [x['decisions'] for x in paths]:
-        paths.append({'decisions': decisions, 'path': new_path, 'cmp_trees': cmp_trees})
-
-    return paths
+    return [hoplite_utils.add_execution_plans(path) for path in exec_paths.get_execution_paths(self.original_source)]
 
   def get_subgraph_for(self, node_id, graph):
-    # Generate list of all the predecessors of the node node_id
-    op_preds = []
-    new_preds = [node_id]
-    while new_preds:
-      node = new_preds.pop()
-      op_preds.append(node)
-
-      for pred in graph[node]['preds']:
-          new_preds.append(pred)
-
-    op_preds = list(set(op_preds))
-
-    # Copy the graph and delete every node
-    #  that doesn't precede node node_id
-    subgraph = copy.deepcopy(graph)
-
-    for n in [x for x in subgraph if x not in op_preds]:
-      del subgraph[n]
-
-    # Remove all successors that are not in the graph.
-    for n in subgraph:
-      subgraph[n]['succs'] = [x for x in subgraph[n]['succs'] if x in subgraph]
-
-    return subgraph
+    return exec_paths.get_subgraph_for(node_id, graph)
 
   # apply_model(path, domain)
   #
@@ -456,42 +337,117 @@ class model_pce_cond:
     if decisions:
       if not decisions in self.precomputed_paths:
         generic_domain = self._get_generic_domain(domain)
-        (clean, noised) = self._run_model(path, generic_domain)
-        self.precomputed_paths[decisions] = (clean, noised, generic_domain)
+        noise_groups = self.get_noise_groups(path)
+        precomputed_file = os.path.join(self.precomputed_files, self.get_precomputed_key(path, generic_domain, noise_groups))
+        if os.path.exists(precomputed_file):
+          print 'Found precomputed path, skipping propagation.'
+          self.precomputed_paths[decisions] = self.load_precomputed_path(precomputed_file)
+        else:
+          (clean, noised, expectances) = self._run_model(path, generic_domain, noise_groups)
+          # The outputs are compiled once, so each subdomain only has to
+          #  evaluate them instead of substituting its coefficients.
+          self.precomputed_paths[decisions] = (generic_outputs.generic_outputs(clean, generic_domain),
+                                               generic_outputs.generic_outputs(noised, generic_domain),
+                                               generic_domain)
+          noises = ['n_' + str(v) for group in noise_groups for v in group if 'n_' + str(v) in self.noise_equivs]
+          self.save_precomputed_path(precomputed_file, self.precomputed_paths[decisions], noises, expectances)
       (clean_outputs, noised_outputs) = self._replace_model(domain, decisions)
     else:
       (clean_outputs, noised_outputs) = self._replace_model(domain, decisions)
     return (clean_outputs, noised_outputs)
 
-  def _run_model(self, path, domain):
-    start_time = time.time()
-    propagation = self.propagate(path['path']['nodes'], domain, self.clean_c_matrix) # TODO: Generate C matrixes "on the fly"
-    clean_outputs = {x: propagation[x] for x in path['path']['outputs']}
-
-    # Generate system graphs with noises
+  # get_noise_groups(path)
+  #
+  # Returns the groups of nodes of the path whose noises are introduced
+  #  together, as given by the partitioner.
+  #
+  def get_noise_groups(self, path):
     # We don't want to add noises to the outputs.
     nodes_to_add_noise = [x for x in path['path']['nodes'].keys() if not x in path['path']['outputs']]
 
     # Generate the subsets of noises that will be introduced together.
     if not self.partitioner == None:
-      noise_groups = self.partitioner.get_partitions(path['path'], nodes_to_add_noise, self.partition_size)
-    else: 
-      noise_groups = [nodes_to_add_noise]
+      return self.partitioner.get_partitions(path['path'], nodes_to_add_noise, self.partition_size)
+    return [nodes_to_add_noise]
 
+  # get_precomputed_key(path, generic_domain, noise_groups)
+  #
+  # Returns the name of the file of a precomputed path: a hash of
+  #  everything its propagation depends on, that is, the path graph,
+  #  the variables and terms of the domain, the order and the noise
+  #  groups.
+  #
+  def get_precomputed_key(self, path, generic_domain, noise_groups):
+    nodes = path['path']['nodes']
+    description = repr((
+      sorted([(n, nodes[n]['op'], nodes[n]['preds'], nodes[n]['succs'], nodes[n].get('cmp', None), nodes[n].get('value', None)) for n in nodes]),
+      [(i, str(self.input_to_rvars[i])) for i in path['path']['inputs']],
+      path['path']['outputs'],
+      sorted([(str(v), sorted([str(t) for t in generic_domain[v]])) for v in generic_domain]),
+      self.order,
+      [list(group) for group in noise_groups]))
+    return hashlib.sha1(description).hexdigest()
+
+  # save_precomputed_path(precomputed_file, precomputed, noises, expectances)
+  #
+  # Stores a precomputed path together with the noises that were added
+  #  to it and the expectances of their terms, which are needed to use
+  #  it in later runs.
+  #
+  def save_precomputed_path(self, precomputed_file, precomputed, noises, expectances):
+    bundle = {
+      'precomputed': precomputed,
+      'noises':      {x: self.noise_equivs[x] for x in noises},
+      'expectances': expectances,
+    }
+    if not os.path.exists(self.precomputed_files): os.makedirs(self.precomputed_files)
+    with open(precomputed_file + '.tmp', 'wb') as pre:
+      pickle.dump(bundle, pre, pickle.HIGHEST_PROTOCOL)
+    os.rename(precomputed_file + '.tmp', precomputed_file)
+
+  # load_precomputed_path(precomputed_file)
+  #
+  # Restores a precomputed path stored by save_precomputed_path(),
+  #  registering its noises and expectances, and returns it.
+  #
+  def load_precomputed_path(self, precomputed_file):
+    with open(precomputed_file, 'rb') as pre:
+      bundle = pickle.load(pre)
+
+    for name, (vSymbol, wlSymbol) in bundle['noises'].iteritems():
+      if not name in self.noise_equivs:
+        self.noise_equivs.update({name: [vSymbol, wlSymbol]})
+        self.noise_inputs.append(name)
+        self.noise_dists.update({vSymbol: {1.0*vSymbol: (2**(-wlSymbol))/2}})
+    self.noise_inputs = sorted(self.noise_inputs, key=lambda x: int(x.split('_')[1]))
+    self.noise_rvars  = [self.noise_equivs[x][0] for x in self.noise_inputs]
+    self.noise_wlvars = [self.noise_equivs[x][1] for x in self.noise_inputs]
+
+    self.noised_expectances.update(bundle['expectances'])
+    return bundle['precomputed']
+
+  def _run_model(self, path, domain, noise_groups):
+    start_time = time.time()
+    propagation = self.propagate(path['path'], domain, self.clean_c_matrix) # TODO: Generate C matrixes "on the fly"
+    clean_outputs = {x: propagation[x] for x in path['path']['outputs']}
+
+    expectances = {}
     noise_propagations = []
     for group in noise_groups:
-      group_graph = copy.deepcopy(path['path'])
+      group_graph = graph_view.derive(path['path'])
       self.add_noises_to(group, group_graph)
+      hoplite_utils.add_execution_plan(group_graph)
       used_inputs = [self.input_to_rvars[i] for i in path['path']['inputs']]
       # Generate C matrix for each group of random variables.
-      noised_c_matrix = c_matrix.c_matrix(used_inputs + [self.noise_equivs['n_' + str(v)][0] for v in group if 'n_' + str(v) in self.noise_equivs], self.order)
+      noised_c_matrix = c_matrix.c_matrix(used_inputs + [self.noise_equivs['n_' + str(v)][0] for v in group if 'n_' + str(v) in self.noise_equivs], self.order, self.c_matrix_workers, lazy=self.c_matrix_lazy)
       # Propagate the PCE coefficients through the system.
       iter_coeffs = dict(domain.items() + self.noise_dists.items())
-      noise_propagations.append(self.propagate(group_graph['nodes'], iter_coeffs, noised_c_matrix))
+      noise_propagations.append(self.propagate(group_graph, iter_coeffs, noised_c_matrix))
 
       # Update the expectances with the results from this iteration.
       for x in noised_c_matrix.expectances:
         self.noised_expectances[x] = noised_c_matrix.expectances[x]
+        expectances[x] = noised_c_matrix.expectances[x]
 
     noised_outputs = {}
     for output in path['path']['outputs']:
@@ -504,7 +460,7 @@ class model_pce_cond:
     exeution_time = time.time() - start_time
     print("Propagating generic domain: %s seconds" % exeution_time) 
 
-    return (clean_outputs, noised_outputs)
+    return (clean_outputs, noised_outputs, expectances)
 
   def _get_generic_domain(self, domain):
     new_domain = {x: {y: None for y in domain[x]} for x in domain}
@@ -518,22 +474,10 @@ class model_pce_cond:
 
   def _replace_model(self, domain, decisions):
     start_time = time.time()
-    generic_domain = self.precomputed_paths[decisions][2]
-
-    clean  = {o: {t: None for t in self.precomputed_paths[decisions][0][o]} for o in self.precomputed_paths[decisions][0]}
-    noised = {o: {t: None for t in self.precomputed_paths[decisions][1][o]} for o in self.precomputed_paths[decisions][1]}
-
-    zipped = []
-    for variable in generic_domain:
-      for term in generic_domain[variable]:
-        var_tuple = (generic_domain[variable][term], domain[variable][term])
-        zipped.append(var_tuple)
+    (generic_clean, generic_noised) = self.precomputed_paths[decisions][:2]
 
-    for output in self.precomputed_paths[decisions][0]:
-      for term in self.precomputed_paths[decisions][0][output]:
-        clean[output][term] = self.precomputed_paths[decisions][0][output][term].subs(zipped)
-      for term in self.precomputed_paths[decisions][1][output]:
-        noised[output][term] = self.precomputed_paths[decisions][1][output][term].subs(zipped)
+    clean  = generic_clean.evaluate(domain)
+    noised = generic_noised.evaluate(domain)
 
     exeution_time = time.time() - start_time
     #print("Replacing values from generic domain: %s seconds" % exeution_time) 
@@ -599,10 +543,11 @@ class model_pce_cond:
 
   # generate_A_matrix(vars)
   #
-  # Matrix A is a matrix of uniform random points in [-1,1]^d.
-  #  It has as many rows as elements in the base, and as many
-  #  columns as random variables in the input. Actually, the
-  #  structure will be a dictionary.
+  # Matrix A holds the elements of the base evaluated at as many
+  #  uniform random points in [-1,1]^d as elements in the base, one
+  #  point per row. It is returned as a float array, together with
+  #  the points, as a matrix with one column per variable of the
+  #  clean base.
   #
   def generate_A_matrix(self, vars):
     random.seed()
@@ -610,15 +555,23 @@ class model_pce_cond:
     tuples = [(i, j) for i in range(base_length) for j in vars]
     random_points = {r: random.uniform(-1,1) for r in tuples}
 
-    a_matrix = []
-    for i in range(base_length):
-      a_matrix.append(self.clean_c_matrix.base[:])
+    points = numpy.zeros((base_length, len(self.clean_c_matrix.vars)))
+    for (i, v), value in random_points.iteritems():
+      points[i, self.clean_c_matrix.vars.index(v)] = value
+    a_matrix = self.clean_c_matrix.evaluate_base(points)
 
-    for key in random_points:
-      for elem in range(base_length):
-        a_matrix[key[0]][elem] = a_matrix[key[0]][elem].subs(key[1], random_points[key])
+    return a_matrix, points
 
-    return a_matrix, random_points
+  # get_projection(vars)
+  #
+  # Generates a set of random points and returns them together with
+  #  the pseudo-inverse of their A matrix. Multiplying it by the values
+  #  of a function at the points projects the function on the base,
+  #  as the least squares solution of A x = u.
+  #
+  def get_projection(self, vars):
+    a_matrix, points = self.generate_A_matrix(vars)
+    return points, linalg.pinv(a_matrix)
 
   # evaluate_partition(partition)
   #
@@ -630,10 +583,13 @@ class model_pce_cond:
   #  result to go one way or the other, depending on how many values pointed
   #  in one direction or the other.
   #
+  # The direction is sampled at up to mc_points random points of the
+  #  domain, evaluating the expansions of both sides of the comparison
+  #  numerically (see fork_sampling.decide_fork()).
+  #
   def evaluate_partition(self, partition):
     start_time = time.time()
-    p = copy.deepcopy(partition)
-    base_length = len(self.clean_c_matrix.base)
+    p = dict(partition)
 
     fork_index = partition['decisions'].index(None)
     fork = partition['forks'][fork_index]
@@ -642,38 +598,16 @@ class model_pce_cond:
 
     # Get the results of expanding the coefficients through the decision tree.
     propagation = self.propagate(tree, p['distributions'], self.clean_c_matrix)
-    lhs = propagation[tree[fork]['preds'][0]]
-    rhs = propagation[tree[fork]['preds'][1]]
-
-    # Generate a number of uniform random points in the domain.
-    tuples = [(i, j) for i in range(base_length) for j in p['distributions'].keys()]
-    random_points = {r: random.uniform(-1,1) for r in tuples}
-
-    # Calculate the complete polynomial.
-    val_lhs = sympy.S(0.0)
-    val_rhs = sympy.S(0.0)
-    for k in lhs: val_lhs += k*lhs[k]
-    for k in rhs: val_rhs += k*rhs[k]
-
-    # Generate the corresponding tuples for replacement.
-    replacement_tuples = [[] for x in range(base_length)]
-    for point in random_points:
-      replacement_tuples[point[0]].append((point[1],random_points[point]))
-
-    # Replace the random variables with its value in each random point
-    #  and evaluate the outcome of the inequation in it.
-    replacement_value = 0
-    for t in replacement_tuples:
-      s_val_lhs = val_lhs.subs(t) 
-      s_val_rhs = val_rhs.subs(t)
-      replacement_value += self.evaluate(s_val_lhs, s_val_rhs, tree[fork]['cmp'])
+    lhs = propagation[tree['nodes'][fork]['preds'][0]]
+    rhs = propagation[tree['nodes'][fork]['preds'][1]]
 
     # Determine if the direction of the fork has been established or not.
-    decisions[fork_index] = {0: False, base_length: True}.get(replacement_value, None)
-    # In case we reach the limit set up by system parameters, decide the
+    #  In case we reach the limit set up by system parameters, decide the
     #  fork direction strictly. This behaviour must be changed from here
     #  if needed.
-    if p['j_k'] <= self.j_lim: decisions[fork_index] = replacement_value >= (base_length / 2)
+    decisions[fork_index] = fork_sampling.decide_fork(self.clean_c_matrix, lhs, rhs, tree['nodes'][fork]['cmp'],
+                                                      p['distributions'].keys(), p['j_k'] <= self.j_lim,
+                                                      self.mc_points, self.mc_confidence)
     p['decisions'] = tuple(decisions)
 
     exeution_time = time.time() - start_time
@@ -695,22 +629,25 @@ class model_pce_cond:
     if on_vars is None:
       vars = partition['distributions'].keys()
     else:
-      vars = copy.deepcopy(on_vars)
+      vars = list(on_vars)
+
+    partitions = [dict(partition)]
 
-    partitions = [copy.deepcopy(partition)]
+    # All the splits share the same points and pseudo-inverse of A.
+    projection = self.get_projection(partition['distributions'].keys())
 
     while vars:
       v = vars.pop()
       new_partitions = []
       while partitions:
         p = partitions.pop()
-        new_partitions += self.split_on(p,v)
+        new_partitions += self.split_on(p,v,projection)
       partitions = new_partitions
     exeution_time = time.time() - start_time
     # print("Generate new partitions: %s seconds" % exeution_time) 
     return partitions
 
-  # split_on(partition, var)
+  # split_on(partition, var[, projection])
   #
   # This method for splitting a random variable follows the procedure
   #  explained in:
@@ -718,12 +655,20 @@ class model_pce_cond:
   #     generalized polynomial chaos method for stochastic differential
   #     equations. Journal of Computational Physics, 209(2), 617-642.
   #
-  def split_on(self, partition, var):
-    p0 = copy.deepcopy(partition)
-    p1 = copy.deepcopy(partition)
+  # The projection (points and pseudo-inverse of A) can be given to
+  #  share it between splits. Otherwise a new one is generated.
+  #
+  def split_on(self, partition, var, projection=None):
+    # The new partitions share everything but the domain and the
+    #  distributions with the parent, which are only replaced, never
+    #  modified.
+    p0 = dict(partition, domain=dict(partition['domain']), distributions=dict(partition['distributions']))
+    p1 = dict(partition, domain=dict(partition['domain']), distributions=dict(partition['distributions']))
 
     base_length = len(self.clean_c_matrix.base)
-    a_matrix, random_points = self.generate_A_matrix(partition['distributions'].keys())
+    if projection is None:
+      projection = self.get_projection(partition['distributions'].keys())
+    points, pseudo_inverse = projection
 
     # 'fork', 'tree' and 'direction' are the same as in the parent.
     # 'j_k'
@@ -736,28 +681,22 @@ class model_pce_cond:
     p1['domain'][var] = (middle_point, partition['domain'][var][1])
 
     # 'distributions'
+    # The expansion of the variable is evaluated at the points with the
+    #  variable rescaled to each half, [-1,0] and [0,1], and projected
+    #  on the base to get the expansions in the new subdomains.
     coeffs = partition['distributions'][var]
-    upper = Symbol('upper')
-    lower = Symbol('lower')
-    resize_form = ((upper - lower) / 2) * var + (upper + lower) / 2;
-
-    equation = 0.0
-    for c in coeffs: equation += c*coeffs[c]
-    equation = equation.subs(var, resize_form)
-
-    u_hat_0 = []
-    u_hat_1 = []
+    column = self.clean_c_matrix.vars.index(var)
 
-    for i in range(base_length):
-      all_subs = [(v, random_points[(i,v)]) for v in partition['distributions'].keys()]
-      u_hat_0.append([equation.subs([(lower,-1),(upper,0)] + all_subs)])
-      u_hat_1.append([equation.subs([(lower, 0),(upper,1)] + all_subs)])
+    u_hat = numpy.zeros((base_length, 2))
+    for n, (lower, upper) in enumerate([(-1.0, 0.0), (0.0, 1.0)]):
+      resized = points.copy()
+      resized[:, column] = ((upper - lower) / 2) * points[:, column] + (upper + lower) / 2
+      u_hat[:, n] = self.clean_c_matrix.evaluate_expansion(coeffs, resized)
 
-    coeffs_0 = [x[0] for x in list(linalg.lstsq(a_matrix,u_hat_0)[0])]
-    coeffs_1 = [x[0] for x in list(linalg.lstsq(a_matrix,u_hat_1)[0])]
+    coeffs_0, coeffs_1 = pseudo_inverse.dot(u_hat).T
 
-    new_coeffs_0 = {self.clean_c_matrix.base[i]: coeffs_0[i] for i in range(base_length) if abs(coeffs_0[i]) > 1e-12}
-    new_coeffs_1 = {self.clean_c_matrix.base[i]: coeffs_1[i] for i in range(base_length) if abs(coeffs_1[i]) > 1e-12}
+    new_coeffs_0 = {self.clean_c_matrix.base[i]: float(coeffs_0[i]) for i in range(base_length) if abs(coeffs_0[i]) > 1e-12}
+    new_coeffs_1 = {self.clean_c_matrix.base[i]: float(coeffs_1[i]) for i in range(base_length) if abs(coeffs_1[i]) > 1e-12}
 
     p0['distributions'][var] = new_coeffs_0
     p1['distributions'][var] = new_coeffs_1
@@ -4,28 +4,109 @@
 #  Licensed under the MIT license: http://www.opensource.org/licenses/mit-license.php
 #
 import numpy
+import multiprocessing
+import multiprocessing.pool
+
+# Model used by the workers of the evaluation pool. It is set when the
+#  pool starts, so it is never pickled.
+_worker_model = None
+
+def _init_worker(model):
+  global _worker_model
+  _worker_model = model
+
+def _noise_variance(wlv):
+  return _worker_model.get_noise_variance(wlv)
 
 class search_max_minus_one:
 
-  def __init__(self, source_config, model, log=None):
-    self.limits = source_config['noise_lims']
-    self.model  = model
-    self.log    = log
+  # Models with a batched evaluator get all the candidates of each
+  #  iteration in a single call. Otherwise the candidates are spread in
+  #  chunks over a pool of 'workers' threads or processes, depending on
+  #  'pool' ('thread' or 'process'), or evaluated one after the other if
+  #  there are no workers.
+  #
+  # The uniform WLV is searched by bisection in [min_wl, max_wl]. If
+  #  check_monotonicity is set, the variances found in the process are
+  #  checked to decrease with the word-length for every output, and
+  #  the search falls back to decreasing the word-lengths one by one
+  #  if they do not.
+  #
+  # If the model has delta_variance(), the candidates of the variable
+  #  WLV search are evaluated as changes to the reference WLV.
+  #
+  def __init__(self, source_config, model, log=None, workers=None, pool='thread',
+               min_wl=1, max_wl=32, check_monotonicity=False):
+    self.limits  = source_config['noise_lims']
+    self.model   = model
+    self.log     = log
+    self.workers = workers
+    self.pool_type = pool
+    self.pool    = None
+    self.min_wl  = min_wl
+    self.max_wl  = max_wl
+    self.check_monotonicity = check_monotonicity
 
   def run(self):
-    initial_wlv = self.model.num_noises * [32]
-    uniform_wlv = self._search_uniform_wlv(initial_wlv)
-    variable_wlv = self._search_variable_wlv(uniform_wlv)
+    # The pool is started here, once the model has been computed, so
+    #  the process workers get a copy of the computed model. It is not
+    #  needed if the model has a batched evaluator.
+    if self.workers and not hasattr(self.model, 'get_noise_variances'):
+      if self.pool_type == 'process':
+        self.pool = multiprocessing.Pool(self.workers, _init_worker, (self.model,))
+      else:
+        self.pool = multiprocessing.pool.ThreadPool(self.workers, _init_worker, (self.model,))
+
+    try:
+      uniform_wlv = self._search_uniform_wlv()
+      variable_wlv = self._search_variable_wlv(uniform_wlv)
+    finally:
+      if not self.pool is None:
+        self.pool.terminate()
+        self.pool.join()
+        self.pool = None
 
-  def _search_uniform_wlv(self, initial_wlv):
+  def _search_uniform_wlv(self):
     self._log('Searching uniform WLV', 'info')
     clean_variance = self.model.get_signal_variance()
-    wlv = initial_wlv
+    uniform = lambda w: self.model.num_noises * [w]
+
+    # Word-lengths tried, to check the monotonicity afterwards.
+    tried = set()
+    def is_valid(w):
+      tried.add(w)
+      return not self._exceeds_limits(self._get_noise_variances([uniform(w)])[0], clean_variance)
+
+    if not is_valid(self.max_wl):
+      return uniform(self.max_wl + 1)
 
-    while not [x for x in range(len(clean_variance)) if self.model.get_noise_variance(wlv)[x] - clean_variance[x] > self.limits[x]]:
-      wlv = [w - 1 for w in wlv]
-    
-    return [w + 1 for w in wlv]
+    # Smallest valid word-length, assuming that the noise variances
+    #  decrease when the word-length grows. 'high' is always valid.
+    low, high = self.min_wl, self.max_wl
+    while low < high:
+      middle = (low + high) / 2
+      if is_valid(middle):
+        high = middle
+      else:
+        low = middle + 1
+
+    if self.check_monotonicity and not self._is_monotonic(tried):
+      self._log('Noise variances do not decrease with the word-length, searching uniform WLV sequentially', 'info')
+      high = self.max_wl
+      while high > self.min_wl and is_valid(high - 1):
+        high -= 1
+
+    return uniform(high)
+
+  # Checks that the noise variances of the uniform WLVs with the given
+  #  word-lengths do not increase with them for any output.
+  def _is_monotonic(self, word_lengths):
+    variances = self._get_noise_variances([self.model.num_noises * [w] for w in sorted(word_lengths)])
+    return all(variances[n + 1][x] <= variances[n][x] for n in range(len(variances) - 1) for x in range(len(variances[n])))
+
+  # Checks if the noise variances exceed the limits for any output.
+  def _exceeds_limits(self, variances, clean_variance):
+    return [x for x in range(len(clean_variance)) if variances[x] - clean_variance[x] > self.limits[x]]
 
   def _search_variable_wlv(self, initial_wlv):
     self._log('Searching variable WLV', 'info')
@@ -36,11 +117,21 @@ class search_max_minus_one:
     n_iters = 0
 
     while True:
-      ref_variances = self.model.get_noise_variance(wlv)
-
       candidate_wlvs = [[wlv[y] - 1 if y == x else wlv[y] for y in range(len(wlv))] for x in range(len(wlv))]
 
-      candidate_variances = [self.model.get_noise_variance(x) for x in candidate_wlvs]
+      if hasattr(self.model, 'delta_variance'):
+        # Each candidate only moves one word-length, so its variances
+        #  are obtained updating those of the reference WLV.
+        ref_variances = self._get_noise_variances([wlv])[0]
+        candidate_variances = []
+        for x in range(len(wlv)):
+          delta = self.model.delta_variance(wlv, x, wlv[x] - 1)
+          candidate_variances.append([ref_variances[y] + delta[y] for y in range(len(ref_variances))])
+      else:
+        # The reference WLV is evaluated together with the candidates.
+        variances = self._get_noise_variances([wlv] + candidate_wlvs)
+        ref_variances = variances[0]
+        candidate_variances = variances[1:]
 
       valid_candidates = [c for c in candidate_variances if [x for x in range(len(clean_variance)) if c[x] - clean_variance[x] <= self.limits[x]]]
       if not valid_candidates:
@@ -55,6 +146,17 @@ class search_max_minus_one:
       print wlv
       n_iters += 1
 
+  # Returns the noise variances of the outputs for each of the WLVs.
+  #  The WLVs evaluated before are not computed again if the model is
+  #  wrapped in a wlv_cache.
+  def _get_noise_variances(self, wlvs):
+    if hasattr(self.model, 'get_noise_variances'):
+      return [list(v) for v in self.model.get_noise_variances(wlvs)]
+    if not self.pool is None and len(wlvs) > 1:
+      chunk = -(-len(wlvs) // self.workers)
+      return [list(v) for v in self.pool.map(_noise_variance, wlvs, chunk)]
+    return [list(self.model.get_noise_variance(x)) for x in wlvs]
+
   def _log(self, message, priority):
     if self.log is None:
       print priority.upper(), '-', message
@@ -0,0 +1,148 @@
+#  @author  Enrique Sedano
+#  @version  0.14.07
+#
+#  Licensed under the MIT license: http://www.opensource.org/licenses/mit-license.php
+#
+import os
+import shelve
+import hashlib
+import threading
+
+from collections import OrderedDict
+
+# -----------------------------------------------------------------
+# Memoizing wrapper around the noise queries of a model. The noise
+#  means and variances are kept in a bounded LRU cache keyed by the
+#  WordLength Vector, so the searches never pay twice for the same
+#  point. Any other attribute is taken from the wrapped model.
+#
+# If a spill file is given, the entries evicted from the cache are
+#  stored in it instead of being lost, and close() stores the rest,
+#  so later searches on the same model (or a restart using the same
+#  destination) find them there. The entries are only valid for the
+#  model they come from, so the name of the file should identify it
+#  (see fingerprint()).
+#
+# The cache can be shared by threads, such as the 'thread' workers of
+#  the search pool. Processes forked from the one that created it, such
+#  as the 'process' workers, keep using their copy of the cache in
+#  memory, but never touch the spill file, as its handle would be
+#  shared with the parent.
+#
+class wlv_cache(object):
+  def __init__(self, model, size=4096, spill=None):
+    self.model = model
+    self.size  = size
+    self.cache = OrderedDict()
+    self.spill = None if spill is None else shelve.open(spill)
+    self.pid   = os.getpid()
+    self.lock  = threading.RLock()
+
+    self.hits   = 0
+    self.misses = 0
+
+    # Only offer the batched evaluator when the model has one.
+    if hasattr(model, 'get_noise_variances'):
+      self.get_noise_variances = self._get_noise_variances
+
+  def __getattr__(self, name):
+    return getattr(self.model, name)
+
+  # The output is only passed to the model when it is given, as the
+  #  searches ask for all of them.
+  def get_noise_mean(self, wlv, output=None):
+    arguments = (wlv,) if output is None else (wlv, output)
+    return self._get(('mean', tuple(wlv), output), lambda: self.model.get_noise_mean(*arguments))
+
+  def get_noise_variance(self, wlv, output=None):
+    arguments = (wlv,) if output is None else (wlv, output)
+    return self._get(('variance', tuple(wlv), output), lambda: self.model.get_noise_variance(*arguments))
+
+  # Batched version of get_noise_variance(wlv). Only the WLVs that are
+  #  not cached are sent to the model, all of them in a single call.
+  def _get_noise_variances(self, wlvs):
+    keys = [('variance', tuple(x), None) for x in wlvs]
+    with self.lock:
+      values = [self._lookup(k) for k in keys]
+
+    missing = [n for n in range(len(keys)) if values[n] is None]
+    if missing:
+      computed = self.model.get_noise_variances([wlvs[n] for n in missing])
+      with self.lock:
+        for n, value in zip(missing, computed):
+          values[n] = list(value)
+          self._store(keys[n], values[n])
+
+    return values
+
+  # Stores the cached entries in the spill file and closes it.
+  def close(self):
+    with self.lock:
+      spill = self._get_spill()
+      if not spill is None:
+        for key, value in self.cache.iteritems():
+          spill[repr(key)] = value
+        spill.close()
+        self.spill = None
+
+  # The model is queried without holding the lock, so concurrent
+  #  queries for different WLVs are not serialized.
+  def _get(self, key, compute):
+    with self.lock:
+      value = self._lookup(key)
+    if value is None:
+      value = compute()
+      with self.lock:
+        self._store(key, value)
+    return value
+
+  # Returns the spill file, or None if there is none or the cache is
+  #  used from a forked process.
+  def _get_spill(self):
+    if os.getpid() != self.pid:
+      return None
+    return self.spill
+
+  # _lookup() and _store() must be called holding the lock.
+  def _lookup(self, key):
+    if key in self.cache:
+      self.hits += 1
+      value = self.cache.pop(key)
+      self.cache[key] = value
+      return value
+
+    spill = self._get_spill()
+    if not spill is None and repr(key) in spill:
+      self.hits += 1
+      value = spill[repr(key)]
+      self._store(key, value)
+      return value
+
+    self.misses += 1
+    return None
+
+  def _store(self, key, value):
+    self.cache[key] = value
+    spill = self._get_spill()
+    while len(self.cache) > self.size:
+      old_key, old_value = self.cache.popitem(last=False)
+      if not spill is None:
+        spill[repr(old_key)] = old_value
+
+# fingerprint(*parts)
+#
+# Returns a hash of the given objects (configuration dicts, system
+#  graphs...) that does not depend on the order of the dicts, to tell
+#  apart the spill files of different models.
+#
+def fingerprint(*parts):
+  return hashlib.sha1(repr(_canonical(parts))).hexdigest()
+
+def _canonical(value):
+  if isinstance(value, dict):
+    return sorted([(_canonical(k), _canonical(v)) for k, v in value.iteritems()])
+  if isinstance(value, (list, tuple)):
+    return [_canonical(x) for x in value]
+  if isinstance(value, (set, frozenset)):
+    return sorted([_canonical(x) for x in value])
+  return repr(value)
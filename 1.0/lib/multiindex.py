@@ -0,0 +1,73 @@
+#
+# --------------------------------------------------------------------------------------------------
+#     __  ______  ____  __    ________________
+#    / / / / __ \/ __ \/ /   /  _/_  __/ ____/
+#   / /_/ / / / / /_/ / /    / /  / / / __/
+#  / __  / /_/ / ____/ /____/ /  / / / /___
+# /_/ /_/\____/_/   /_____/___/ /_/ /_____/   (v1.0 . Achilles)
+#
+# Licensed under the MIT license: http://www.opensource.org/licenses/mit-license.php
+# --------------------------------------------------------------------------------------------------
+"""
+Graded multi-indices of the PCE bases.
+"""
+
+# ------------------------------------------
+# Imports section
+# ------------------------------------------
+import sys
+from math import factorial
+# -------------------------
+sys.dont_write_bytecode = True
+# -------------------------
+
+_ORDERS = {}
+_RANKS = {}
+
+def graded(dim, order):
+    """ Generates the multi-indices of dimension dim with total degree up to order, by
+    increasing total degree and, for the same degree, in lexicographic order. Only the
+    valid multi-indices are visited.
+    """
+    for degree in xrange(order + 1):
+        for multi_index in _compositions(degree, dim):
+            yield multi_index
+
+def _compositions(degree, dim):
+    """ Generates the tuples of dim non-negative integers adding up to degree, in
+    lexicographic order.
+    """
+    if dim == 0:
+        if degree == 0:
+            yield ()
+        return
+    if dim == 1:
+        yield (degree,)
+        return
+    for first in xrange(degree + 1):
+        for rest in _compositions(degree - first, dim - 1):
+            yield (first,) + rest
+
+def count(dim, order):
+    """ Number of multi-indices up to the given order, that is, the size of the base.
+    """
+    return factorial(dim + order) / (factorial(dim) * factorial(order))
+
+def orders(dim, order):
+    """ List of graded multi-indices, mapping positions in the base to multi-indices.
+    It is memoized, so it must not be modified.
+    """
+    key = (dim, order)
+    if key not in _ORDERS:
+        _ORDERS[key] = list(graded(dim, order))
+    return _ORDERS[key]
+
+def ranks(dim, order):
+    """ Dict mapping the multi-indices to their positions in the base. It is memoized, so
+    it must not be modified.
+    """
+    key = (dim, order)
+    if key not in _RANKS:
+        indices = orders(dim, order)
+        _RANKS[key] = {indices[n]: n for n in xrange(len(indices))}
+    return _RANKS[key]
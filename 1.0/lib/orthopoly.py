@@ -0,0 +1,88 @@
+#
+# --------------------------------------------------------------------------------------------------
+#     __  ______  ____  __    ________________
+#    / / / / __ \/ __ \/ /   /  _/_  __/ ____/
+#   / /_/ / / / / /_/ / /    / /  / / / __/
+#  / __  / /_/ / ____/ /____/ /  / / / /___
+# /_/ /_/\____/_/   /_____/___/ /_/ /_____/   (v1.0 . Achilles)
+#
+# Licensed under the MIT license: http://www.opensource.org/licenses/mit-license.php
+# --------------------------------------------------------------------------------------------------
+"""
+Orthogonal polynomials of the PCE bases.
+
+This is a copy of 0.5/models/lib/orthopoly.py with the same API, as the two trees are
+independent and do not share any module.
+"""
+
+# ------------------------------------------
+# Imports section
+# ------------------------------------------
+import sys
+import numpy
+import sympy
+from fractions import Fraction
+# -------------------------
+sys.dont_write_bytecode = True
+# -------------------------
+
+_COEFFICIENTS = {}
+_POLYNOMIALS = {}
+
+def legendre_coefficients(order):
+    """ Coefficients of the Legendre polynomials up to the given order, in increasing
+    powers of the variable, from the recurrence (n+1)P_{n+1} = (2n+1)xP_n - nP_{n-1}
+    computed with exact fractions.
+    """
+    coeffs = [[Fraction(1)], [Fraction(0), Fraction(1)]]
+    for n in xrange(1, order):
+        shifted = [Fraction(0)] + coeffs[n]
+        previous = coeffs[n-1] + [Fraction(0), Fraction(0)]
+        coeffs.append([((2*n + 1)*shifted[p] - n*previous[p]) / (n + 1) for p in xrange(n + 2)])
+    return coeffs[:order+1]
+
+def legendre_values(order, x):
+    """ Evaluates the Legendre polynomials up to the given order on an array of numeric
+    values, running the same recurrence on the values, which avoids the powers of x and
+    the cancellations between the large coefficients of the high orders. Returns an array
+    with one row per polynomial.
+    """
+    values = numpy.empty((order + 1,) + x.shape)
+    values[0] = 1.0
+    if order > 0:
+        values[1] = x
+    for n in xrange(1, order):
+        values[n+1] = ((2*n + 1)*x*values[n] - n*values[n-1]) / (n + 1)
+    return values
+
+FAMILIES = {'legendre': legendre_coefficients}
+EVALUATORS = {'legendre': legendre_values}
+
+def get_coefficients(family, order):
+    """ NumPy array with one row per polynomial up to the given order and one column per
+    power of the variable. It is memoized, so it must not be modified.
+    """
+    key = (family, order)
+    if key not in _COEFFICIENTS:
+        table = numpy.zeros((order + 1, order + 1))
+        for n, coeffs in enumerate(FAMILIES[family](order)):
+            table[n, :len(coeffs)] = [float(c) for c in coeffs]
+        _COEFFICIENTS[key] = table
+    return _COEFFICIENTS[key]
+
+def get_polynomials(family, order, var):
+    """ List of sympy polynomials up to the given order on the given variable. It is
+    memoized, so it must not be modified.
+    """
+    key = (family, order, var)
+    if key not in _POLYNOMIALS:
+        table = get_coefficients(family, order)
+        _POLYNOMIALS[key] = [sum([sympy.S(float(table[n, p]))*(var**p) for p in xrange(n + 1)])
+                             for n in xrange(order + 1)]
+    return _POLYNOMIALS[key]
+
+def evaluate(family, order, x):
+    """ Evaluates the polynomials up to the given order on an array of numeric values, by
+    recurrence. Returns an array with one row per polynomial.
+    """
+    return EVALUATORS[family](order, numpy.asarray(x, dtype=numpy.float64))
@@ -24,6 +24,8 @@ sys.dont_write_bytecode = True
 # -------------------------
 
 import hoplitebase
+import multiindex
+import orthopoly
 
 # ------------------------------------------
 
@@ -33,20 +35,21 @@ class Cmatrix(hoplitebase.HopliteBase):
     def __init__(self, parent=None, work_path=None, log=None):
         super(Cmatrix, self).__init__('cmatrix', parent, work_path, log)
 
+    def base_orders(self, dim, order):
+        """ Multi-indices of the base terms for dim variables up to the given order.
+        """
+        return list(multiindex.orders(dim, order))
+
+    def base_ranks(self, dim, order):
+        """ Positions in the base of each multi-index.
+        """
+        return multiindex.ranks(dim, order)
+
     def legendre(self, order, symbol):
         return [self._legendre_order(o, symbol) for o in xrange(order)]
 
     def _legendre_order(self, order, symbol):
-        num = [[1], [0, 1], [-1, 0, 3], [0, -3, 0, 5], [3, 0, -30, 0, 35],
-            [0, 15, 0, -70, 0, 63], [-5, 0, 105, 0, -315, 0, 231],
-            [0, -35, 0, 315, 0, -693, 0, 429],
-            [35, 0, -1260, 0, 6930, 0, -12012, 0, 6435],
-            [0, 315, 0, -4620, 0, 18018, 0, -25740, 0, 12155],
-            [-63, 0, 3465, 0, -30030, 0, 90090, 0, -109395, 0, 46189]]
-        div = [1, 1, 2, 2, 8, 8, 16, 16, 128, 128, 256]
-        coeffs = [sympy.S(float(n)/div[order]) for n in num[order]]
-
-        return sum([val*(symbol**idx) for idx, val in enumerate(coeffs)])
+        return orthopoly.get_polynomials('legendre', order, symbol)[order]
 
 class PolynomialChaos(hoplitebase.HopliteBase):
     """ PolynomialChaos class